@@ -0,0 +1,70 @@
+from unittest.mock import patch
+import click
+import os
+import socket
+import threading
+
+
+from tests import fixture_setup
+import vendorize.client
+import vendorize.daemon
+
+
+class DaemonTestCase(fixture_setup.ProcessorBaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.address = os.path.join(os.getcwd(), 'vendorize.sock')
+        self.daemon = vendorize.daemon.Daemon(
+            self.address, cache_dir=os.path.join(os.getcwd(), 'cache'))
+        thread = threading.Thread(target=self.daemon.serve)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.daemon.shutdown)
+        while not os.path.exists(self.address):
+            thread.join(0.01)
+
+    def job(self, **kwargs):
+        job = dict(project_folder=os.getcwd(),
+                   target='git+ssh://localhost/~user/test',
+                   allowed_hosts=['localhost'], dry_run=True, debug=False)
+        job.update(kwargs)
+        return job
+
+    def test_submit(self):
+        vendorize.client.submit(self.address, self.job())
+
+    def test_submit_error(self):
+        os.remove(self.snapcraft_yaml)
+        error = self.assertRaises(click.ClickException,
+                                  vendorize.client.submit,
+                                  self.address, self.job())
+        self.assertEqual(error.message, 'No snapcraft.yaml found')
+
+    @patch('vendorize.processor.Processor')
+    def test_client_environment(self, mock_processor):
+        with patch.dict(os.environ, {'SOURCE_DATE_EPOCH': '1500000000',
+                                     'REAL_NAME': 'Client'}):
+            vendorize.client.submit(self.address, self.job(reproducible=True))
+        environ = mock_processor.call_args[1]['environ']
+        self.assertEqual(environ['SOURCE_DATE_EPOCH'], '1500000000')
+        self.assertEqual(environ['REAL_NAME'], 'Client')
+        self.assertNotIn('USER', environ)
+
+    def test_no_daemon(self):
+        self.assertRaises(click.ClickException, vendorize.client.submit,
+                          os.path.join(os.getcwd(), 'missing.sock'),
+                          self.job())
+
+    @patch('socket.gethostbyname')
+    def test_transient_lookup_failure(self, mock_gethostbyname):
+        job = self.job(target='git+ssh://flaky.example.com/~user/test',
+                       allowed_hosts=['flaky.example.com'])
+        mock_gethostbyname.side_effect = socket.gaierror
+        self.assertRaises(click.ClickException, vendorize.client.submit,
+                          self.address, job)
+        mock_gethostbyname.side_effect = None
+        vendorize.client.submit(self.address, job)
+        vendorize.client.submit(self.address, job)
+        mock_gethostbyname.assert_called_with('flaky.example.com')
+        self.assertEqual(mock_gethostbyname.call_count, 2)
@@ -0,0 +1,155 @@
+import http.server
+import os
+import shutil
+import tempfile
+import testtools
+import threading
+import time
+
+
+import vendorize.download
+
+
+class FlakyHandler(http.server.BaseHTTPRequestHandler):
+    """Serve a single file, optionally dropping the connection or stalling
+    midway.
+    """
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        if server.status:
+            self.send_error(server.status)
+            return
+        if self.headers.get('If-None-Match') == server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        data = server.data
+        start = 0
+        if (self.headers.get('Range') and
+                self.headers.get('If-Range') == server.etag):
+            start = int(self.headers['Range'][len('bytes='):-1])
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, len(data) - 1, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.send_header('ETag', server.etag)
+        self.end_headers()
+        if server.drop:
+            self.wfile.write(data[start:start + server.drop])
+            server.drop = 0
+            return
+        if server.stall:
+            self.wfile.write(data[start:start + 1000])
+            self.wfile.flush()
+            time.sleep(server.stall)
+            server.stall = 0
+            # The client has given up in the meantime
+            return
+        self.wfile.write(data[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+class DownloadTestCase(testtools.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.mkdtemp(dir=os.environ.get('TMPDIR'))
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.filename = os.path.join(self.tmpdir, 'foo.tar.gz')
+
+        self.server = http.server.HTTPServer(('127.0.0.1', 0), FlakyHandler)
+        self.server.data = os.urandom(100000)
+        self.server.etag = '"v1"'
+        self.server.drop = 0
+        self.server.status = 0
+        self.server.stall = 0
+        self.server.requests = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:{}/foo.tar.gz'.format(
+            self.server.server_port)
+
+        self.downloader = vendorize.download.Downloader(
+            retries=2, timeout=5)
+        self.sleeps = []  # type: list
+        self.downloader.sleep = self.sleeps.append
+
+    def read(self):
+        with open(self.filename, 'rb') as f:
+            return f.read()
+
+    def test_fetch(self):
+        self.downloader.fetch(self.url, self.filename)
+        self.assertEqual(self.read(), self.server.data)
+        self.assertFalse(os.path.exists(self.filename + '.part'))
+
+    def test_resume(self):
+        self.server.drop = 30000
+        self.downloader.fetch(self.url, self.filename)
+        self.assertEqual(self.read(), self.server.data)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.requests[1]['Range'], 'bytes=30000-')
+        self.assertEqual(self.sleeps, [1])
+
+    def test_read_timeout(self):
+        self.server.stall = 0.5
+        self.downloader.timeout = 0.1
+        self.downloader.chunk_size = 1000
+
+        def sleep(delay):
+            # The server only handles one request at a time
+            self.sleeps.append(delay)
+            time.sleep(self.server.stall)
+        self.downloader.sleep = sleep
+        self.downloader.fetch(self.url, self.filename)
+        self.assertEqual(self.read(), self.server.data)
+        self.assertEqual(len(self.sleeps), 1)
+        self.assertEqual(self.server.requests[-1]['Range'], 'bytes=1000-')
+
+    def test_resume_changed(self):
+        self.server.drop = 30000
+        self.downloader.retries = 0
+        self.assertRaises(vendorize.download.DownloadError,
+                          self.downloader.fetch, self.url, self.filename)
+        self.server.data = os.urandom(50000)
+        self.server.etag = '"v2"'
+        self.downloader.fetch(self.url, self.filename)
+        self.assertEqual(self.read(), self.server.data)
+
+    def test_revalidate(self):
+        self.downloader.fetch(self.url, self.filename)
+        self.downloader.fetch(self.url, self.filename)
+        self.assertEqual(self.server.requests[1]['If-None-Match'], '"v1"')
+        self.assertEqual(self.read(), self.server.data)
+
+        self.server.data = os.urandom(1000)
+        self.server.etag = '"v2"'
+        self.downloader.fetch(self.url, self.filename)
+        self.assertEqual(self.read(), self.server.data)
+
+    def test_backoff(self):
+        self.server.status = 503
+        self.assertRaises(vendorize.download.DownloadError,
+                          self.downloader.fetch, self.url, self.filename)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.sleeps, [1, 2])
+
+    def test_no_retry(self):
+        self.server.status = 404
+        self.assertRaises(vendorize.download.DownloadError,
+                          self.downloader.fetch, self.url, self.filename)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_offline_cache(self):
+        self.downloader.fetch(self.url, self.filename)
+        self.server.status = 503
+        self.downloader.fetch(self.url, self.filename)
+        self.assertEqual(self.read(), self.server.data)
@@ -1,7 +1,14 @@
 import fixture_setup
+import logging
+import os
+import subprocess
 from unittest.mock import patch, call
 
 
+import vendorize.bundle
+import vendorize.git
+
+
 class GitTestCase(fixture_setup.ProcessorBaseTestCase):
 
     def setUp(self):
@@ -12,5 +19,151 @@ class GitTestCase(fixture_setup.ProcessorBaseTestCase):
     def test_clone(self, mock_check_call):
         self.git.clone('source', 'folder')
         mock_check_call.assert_has_calls([
-            call(['git', 'clone', '--recursive', 'source', 'folder'])
+            call(['git', 'clone', 'source', 'folder'])
         ])
+
+    @patch('subprocess.check_call')
+    def test_clone_submodules(self, mock_check_call):
+        os.makedirs('folder')
+        open(os.path.join('folder', '.gitmodules'), 'w').close()
+        self.git.clone('source', 'folder', jobs=8)
+        mock_check_call.assert_has_calls([
+            call(['git', 'clone', 'source', 'folder']),
+            call(['git', 'submodule', 'update', '--init', '--recursive',
+                  '--jobs', '8'], cwd='folder')
+        ])
+
+    @patch('subprocess.check_output')
+    @patch('subprocess.check_call')
+    def test_clone_sparse_submodules(self, mock_check_call,
+                                     mock_check_output):
+        mock_check_output.return_value = (
+            b'S 100644 abc 0\t.gitmodules\n'
+            b'H 160000 def 0\ta/lib\n'
+            b'H 100644 123 0\ta/x\n'
+            b'S 160000 456 0\tb/lib\n')
+        self.git.clone('source', 'folder', jobs=8, sparse=['/a'])
+        mock_check_call.assert_called_with(
+            ['git', 'submodule', 'update', '--init', '--recursive',
+             '--jobs', '8', '--', 'a/lib'], cwd='folder')
+
+    def test_reproducible_commit(self):
+        commits = []
+        for folder in ['foo', 'bar']:
+            os.makedirs(folder)
+            with open(os.path.join(folder, 'README'), 'w') as f:
+                f.write('test')
+            self.git.prepare_branch(folder, 'test', init=True,
+                                    commit='Vendor test', date='1500000000')
+            commits.append(self.git.head(folder))
+        self.assertEqual(commits[0], commits[1])
+        self.assertEqual(self.git.commit_date('foo'), '1500000000')
+
+    def test_explicit_identity(self):
+        git = vendorize.git.Git({'REAL_NAME': 'Client',
+                                 'EMAIL_ADDRESS': 'client@example.com'})
+        os.makedirs('foo')
+        git.prepare_branch('foo', 'test', init=True, commit='Vendor test')
+        self.assertEqual(subprocess.check_output(
+            ['git', 'log', '-1', '--format=%an <%ae> %cn'], cwd='foo'),
+            b'Client <client@example.com> Client\n')
+
+    def test_reproducible_rerun(self):
+        os.makedirs('upstream')
+        with open(os.path.join('upstream', 'README'), 'w') as f:
+            f.write('test')
+        self.git.prepare_branch('upstream', 'master', init=True,
+                                commit='Upstream', date='1400000000')
+        upstream = self.git.head('upstream')
+        subprocess.check_call(['git', 'clone', '-q', 'upstream', 'foo'])
+        os.makedirs('bar')
+        commits = []
+        for i in range(2):
+            # Vendoring again reproduces the same commits
+            self.git.prepare_branch('foo', 'test', commit='Vendor test',
+                                    date='1500000000')
+            self.git.prepare_branch('bar', 'test', init=True,
+                                    commit='Vendor test', date='1500000000')
+            commits.append((self.git.head('foo'), self.git.head('bar')))
+        self.assertEqual(commits[0], commits[1])
+        self.assertEqual(self.git.resolve('foo', 'HEAD^'), upstream)
+        self.assertIsNone(self.git.resolve('bar', 'HEAD^'))
+        self.assertEqual(self.git.commit_date('foo'), '1400000000')
+
+    def test_stage_branch(self):
+        repo = os.path.abspath('staging.git')
+        self.git.init_bare(repo)
+        for folder in ['foo', 'bar']:
+            os.makedirs(folder)
+            with open(os.path.join(folder, 'README'), 'w') as f:
+                f.write('test')
+            self.git.stage_branch(repo, os.path.abspath(folder), folder,
+                                  init=True, commit='Vendor test',
+                                  date='1500000000')
+            self.assertFalse(os.path.exists(os.path.join(folder, '.git')))
+        self.assertEqual(self.git.rev_parse(repo, 'foo'),
+                         self.git.rev_parse(repo, 'bar'))
+
+    def test_previous_branch(self):
+        target = os.path.abspath('target.git')
+        self.git.init_bare(target)
+        commits = []
+        for folder, contents in [('foo', 'old'), ('bar', 'new'),
+                                 ('baz', 'new')]:
+            os.makedirs(folder)
+            with open(os.path.join(folder, 'README'), 'w') as f:
+                f.write(contents)
+            self.git.prepare_branch(folder, 'test', init=True,
+                                    commit='Vendor test', previous=target)
+            self.git.upload_branches(folder, ['test'], target)
+            commits.append(self.git.head(folder))
+        # Changes are committed on top, the same contents are reused
+        self.assertEqual(self.git.resolve('bar', commits[1] + '^'),
+                         commits[0])
+        self.assertEqual(commits[2], commits[1])
+
+    def test_bundle(self):
+        repo = os.path.abspath('staging.git')
+        self.git.init_bare(repo)
+        for folder in ['foo', 'bar']:
+            os.makedirs(folder)
+            with open(os.path.join(folder, 'README'), 'w') as f:
+                f.write(folder)
+            self.git.prepare_branch(folder, folder, init=True,
+                                    commit='Vendor test')
+        vendorize.bundle.export(self.git, {'foo': 'foo', 'bar': 'bar'},
+                                repo, 'test.bundle')
+
+        target = os.path.abspath('target.git')
+        self.git.init_bare(target)
+        logger = logging.getLogger(__name__)
+        for i in range(2):
+            vendorize.bundle.publish(self.git, 'test.bundle', target, logger)
+        self.assertEqual(self.git.list_remote(target), {
+            folder: self.git.head(folder) for folder in ['foo', 'bar']})
+
+    def test_bundle_subfolder(self):
+        repo = os.path.abspath('staging.git')
+        self.git.init_bare(repo)
+        folder = os.path.join('project', 'src')
+        os.makedirs(folder)
+        with open(os.path.join(folder, 'README'), 'w') as f:
+            f.write('test')
+        self.git.prepare_branch('project', 'master', init=True)
+        self.git.prepare_branch(folder, 'test_src', commit='Vendor test')
+        vendorize.bundle.export(self.git, {'test_src': folder},
+                                repo, 'test.bundle')
+        self.assertEqual(self.git.unbundle(repo, 'test.bundle'),
+                         {'test_src': self.git.head('project')})
+
+    def test_sync(self):
+        repo = os.path.abspath('staging.git')
+        remote = os.path.abspath('remote.git')
+        for path in [repo, remote]:
+            self.git.init_bare(path)
+        os.makedirs('foo')
+        self.git.prepare_branch('foo', 'foo', init=True, commit='Vendor')
+        self.git.upload_branches('foo', ['foo'], 'file://' + repo)
+        self.assertEqual(self.git.sync(repo, remote).wait(), 0)
+        self.assertEqual(self.git.list_remote(remote),
+                         {'foo': self.git.head('foo')})
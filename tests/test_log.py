@@ -0,0 +1,66 @@
+import io
+import json
+import logging
+import testtools
+from unittest.mock import patch
+
+
+import vendorize.log
+import vendorize.progress
+
+
+class LogTestCase(testtools.TestCase):
+
+    def test_get_logger(self):
+        for i in range(2):
+            logger = vendorize.log.get_logger(__name__)
+        self.assertEqual(len(logger.handlers), 1)
+
+    def test_status(self):
+        stream = io.StringIO()
+        handler = vendorize.log.StatusHandler(stream)
+        handler.handle(logging.makeLogRecord({'status': 'foo cloning'}))
+        handler.handle(logging.makeLogRecord({
+            'msg': 'Vendoring foo', 'levelname': 'INFO'}))
+        handler.handle(logging.makeLogRecord({'status': ''}))
+        self.assertEqual(stream.getvalue(),
+                         'foo cloning\r\033[KVendoring foo\nfoo cloning'
+                         '\r\033[K')
+
+    @patch.object(vendorize.log, 'is_interactive', return_value=True)
+    @patch.object(vendorize.log.StatusHandler, 'set_status')
+    def test_status_queued(self, mock_set_status, mock_is_interactive):
+        vendorize.log.set_status('foo cloning')
+        # Only the listener thread writes the status line
+        mock_set_status.assert_not_called()
+        vendorize.log.stop()
+        mock_set_status.assert_called_once_with('foo cloning')
+
+    def test_json(self):
+        record = logging.makeLogRecord({
+            'name': 'test', 'msg': 'Vendoring %s', 'args': ('foo',),
+            'levelname': 'INFO', 'created': 1500000000})
+        self.assertEqual(
+            json.loads(vendorize.log.JsonLogFormatter().format(record)),
+            {'time': 1500000000, 'level': 'INFO', 'logger': 'test',
+             'message': 'Vendoring foo'})
+
+
+class ProgressTestCase(testtools.TestCase):
+
+    def test_format_size(self):
+        self.assertEqual(vendorize.progress.format_size(512), '512 B')
+        self.assertEqual(vendorize.progress.format_size(1536), '1.5 KiB')
+        self.assertEqual(vendorize.progress.format_size(3 << 30), '3.0 GiB')
+
+    @patch('time.monotonic', return_value=100)
+    def test_status(self, mock_monotonic):
+        progress = vendorize.progress.Progress(2)
+        progress.report('foo', 'downloading', 1024, 4096)
+        progress.report('bar', 'cloning')
+        mock_monotonic.return_value = 102
+        self.assertEqual(progress.status(),
+                         '[0/2] | foo downloading 1.0 KiB/4.0 KiB '
+                         '512 B/s ETA 6s | bar cloning')
+        progress.finish('foo')
+        self.assertEqual(progress.status(), '[1/2] | bar cloning')
@@ -1,11 +1,16 @@
+from collections import OrderedDict
 from testtools.matchers import FileContains
-from unittest.mock import patch
+from unittest.mock import patch, call
 import click
 import os
 import textwrap
+import threading
 
 
 from tests import fixture_setup
+import vendorize.git
+import vendorize.processor
+import vendorize.util
 
 
 class ProcessorTestCase(fixture_setup.ProcessorBaseTestCase):
@@ -14,6 +19,36 @@ class ProcessorTestCase(fixture_setup.ProcessorBaseTestCase):
         self.assertRaises(click.UsageError,
                           self.make_processor, allowed_hosts=[])
 
+    def test_local_target(self):
+        processor = self.make_processor(target='file://' + os.path.abspath(
+            'target.git'), dry_run=False)
+        self.assertEqual(processor.clone_url, processor.target)
+        self.assertTrue(vendorize.util.is_bare_repository('target.git'))
+
+    @patch.object(vendorize.git.Git, 'prepare_branch')
+    @patch('os.path.isdir', return_value=True)
+    @patch('os.listdir', return_value=['foo'])
+    def test_path_target(self, mock_listdir, mock_isdir, mock_git):
+        target = os.path.abspath('target.git')
+        processor = self.make_processor(target=target, dry_run=False)
+        self.assertEqual(processor.target, target)
+        plugin = processor.load_plugin(
+            'python', self.data, 'test', '.',
+            os.path.join(processor.vendored_source, '.'))
+        plugin.prepare_branches()
+        self.assertThat(
+            os.path.join(processor.vendored_source, 'requirements.txt'),
+            FileContains('git+file://{}@test_python_packages_foo\n'.format(
+                target)))
+
+    def test_sync_target(self):
+        processor = vendorize.processor.Processor(
+            project_folder=os.getcwd(), target=os.path.abspath('target.git'),
+            sync='git+ssh://git.launchpad.net/~user/test',
+            allowed_hosts=['git.launchpad.net'], dry_run=True, debug=False)
+        self.assertEqual(processor.clone_url,
+                         'https://git.launchpad.net/~user/test')
+
     def test_discover_snapcraft_yaml(self):
         with self.make_processor().discover_snapcraft_yaml() as path:
             self.assertEqual(path, 'snap/snapcraft.yaml')
@@ -29,8 +64,9 @@ class ProcessorTestCase(fixture_setup.ProcessorBaseTestCase):
     def test_process_yaml(self):
         self.make_processor().process_yaml('snap/snapcraft.yaml')
 
+    @patch('subprocess.check_output', return_value=b'')
     @patch('subprocess.check_call')
-    def test_yaml_order(self, mock_check_call):
+    def test_yaml_order(self, mock_check_call, mock_check_output):
         contents = textwrap.dedent('''\
             name: test
             version: 1.0
@@ -54,6 +90,78 @@ class ProcessorTestCase(fixture_setup.ProcessorBaseTestCase):
         processor.process_yaml('snap/snapcraft.yaml')
         self.assertThat(vendored_snapcraft_yaml, FileContains(contents))
 
+    @patch.object(vendorize.processor.Processor, 'process_part')
+    def test_local_parts_in_order(self, mock_process_part):
+        os.makedirs('src')
+        parts = OrderedDict([
+            ('b', {'plugin': 'nil', 'source': 'src'}),
+            ('remote', {'plugin': 'nil',
+                        'source': 'https://example.com/foo.tar.gz'}),
+            ('a', {'plugin': 'nil'}),
+        ])
+        data = {'name': 'test', 'parts': parts}
+        threads = {}
+
+        def process_part(part, part_data, data):
+            threads[part] = threading.current_thread()
+        mock_process_part.side_effect = process_part
+        processor = self.make_processor()
+        processor.jobs = 3
+        processor.process_parts(data)
+        mock_process_part.assert_has_calls([
+            call('b', parts['b'], data), call('a', parts['a'], data)])
+        mock_process_part.assert_any_call('remote', parts['remote'], data)
+        self.assertIs(threads['a'], threads['b'])
+
+
+class UploadTestCase(fixture_setup.ProcessorBaseTestCase):
+
+    @patch.object(vendorize.git.Git, 'upload_branches')
+    @patch.object(vendorize.git.Git, 'is_same_tree')
+    @patch.object(vendorize.git.Git, 'rev_parse')
+    @patch.object(vendorize.git.Git, 'list_remote')
+    def test_upload_branches(self, mock_list_remote, mock_rev_parse,
+                             mock_same_tree, mock_upload):
+        processor = self.make_processor(dry_run=False)
+        processor.branches = {'new': 'foo', 'changed': 'bar', 'same': 'baz'}
+        mock_list_remote.return_value = {'changed': '1', 'same': '2'}
+        mock_rev_parse.side_effect = lambda folder, branch: branch
+        mock_same_tree.side_effect = lambda folder, a, b: a == 'same'
+        processor.upload_branches()
+        mock_list_remote.assert_called_once_with(processor.target)
+        mock_upload.assert_has_calls([
+            call('foo', ['new'], processor.target),
+            call('bar', ['changed'], processor.target)])
+        self.assertEqual(mock_upload.call_count, 2)
+
+    @patch.object(vendorize.git.Git, 'upload_branches')
+    @patch.object(vendorize.git.Git, 'is_same_tree', return_value=True)
+    @patch.object(vendorize.git.Git, 'rev_parse')
+    @patch.object(vendorize.git.Git, 'list_remote')
+    def test_upload_submodules(self, mock_list_remote, mock_rev_parse,
+                               mock_same_tree, mock_upload):
+        processor = self.make_processor(dry_run=False)
+        processor.branches = {'lib': 'foo', 'same': 'foo'}
+        processor.submodules = {('url', 'head'): ('lib', '2')}
+        mock_list_remote.return_value = {'lib': '1', 'same': 'same'}
+        mock_rev_parse.side_effect = lambda folder, branch: {
+            'lib': '2', 'same': 'same'}[branch]
+        processor.upload_branches()
+        # Parents refer to the new commit even if the tree is the same
+        mock_upload.assert_called_once_with('foo', ['lib'], processor.target)
+
+    @patch.object(vendorize.git.Git, 'upload_branches')
+    @patch.object(vendorize.git.Git, 'rev_parse')
+    @patch.object(vendorize.git.Git, 'list_remote')
+    def test_upload_staging(self, mock_list_remote, mock_rev_parse,
+                            mock_upload):
+        processor = self.make_processor(dry_run=False)
+        processor.branches = {'foo': 'staging', 'bar': 'staging'}
+        mock_list_remote.return_value = {}
+        processor.upload_branches()
+        mock_upload.assert_called_once_with(
+            'staging', ['foo', 'bar'], processor.target)
+
 
 class PartTestCase(fixture_setup.ProcessorBaseTestCase):
 
@@ -68,3 +176,53 @@ class PartTestCase(fixture_setup.ProcessorBaseTestCase):
         self.assertEqual(self.part_data['source'],
                          'https://git.launchpad.net/~user/test')
         self.assertEqual(self.part_data['source-branch'], 'test_test')
+
+
+class SubmoduleTestCase(fixture_setup.ProcessorBaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.processor = self.make_processor(dry_run=False)
+        for parent in ['foo', 'bar']:
+            os.makedirs(os.path.join(parent, 'lib', '.git'))
+
+    @patch.object(vendorize.git.Git, 'set_submodule')
+    @patch.object(vendorize.git.Git, 'toplevel', side_effect=lambda x: x)
+    @patch.object(vendorize.git.Git, 'prepare_branch')
+    @patch.object(vendorize.git.Git, 'rev_parse')
+    @patch.object(vendorize.git.Git, 'head')
+    @patch.object(vendorize.git.Git, 'list_submodules')
+    def test_shared_submodule(self, mock_list, mock_head, mock_rev_parse,
+                              mock_prepare, mock_toplevel, mock_set):
+        def list_submodules(folder):
+            if folder in ['foo', 'bar']:
+                return [('lib', 'lib', '../lib.git')]
+            return []
+        mock_list.side_effect = list_submodules
+        mock_head.return_value = '0123456789abcdef'
+        mock_rev_parse.return_value = '0123456789abcdef'
+
+        for parent in ['foo', 'bar']:
+            self.assertTrue(self.processor.process_submodules(
+                parent, 'https://github.com/foo/{}.git'.format(parent)))
+        branch = 'submodules_lib_0123456789ab'
+        mock_prepare.assert_called_once_with(
+            os.path.join('foo', 'lib'), branch, init=False, commit=None,
+            date=None, previous=None)
+        mock_set.assert_has_calls([
+            call(parent, 'lib', self.processor.clone_url, branch)
+            for parent in ['foo', 'bar']])
+        self.assertEqual(self.processor.branches[branch],
+                         os.path.join('foo', 'lib'))
+
+    @patch.object(vendorize.git.Git, 'set_submodule')
+    @patch.object(vendorize.git.Git, 'head')
+    @patch.object(vendorize.git.Git, 'list_submodules')
+    def test_allowed_submodule(self, mock_list, mock_head, mock_set):
+        mock_list.side_effect = lambda folder: (
+            [('lib', 'lib', 'https://git.launchpad.net/lib')]
+            if folder == 'foo' else [])
+        mock_head.return_value = '0123456789abcdef'
+        self.assertFalse(self.processor.process_submodules(
+            'foo', 'https://github.com/foo/foo.git'))
+        mock_set.assert_not_called()
@@ -1,9 +1,12 @@
 from unittest.mock import patch, call
+import json
 import os
+import subprocess
 import textwrap
 
 
 import fixture_setup
+import vendorize.plugin
 import vendorize.plugins.python
 
 
@@ -95,3 +98,87 @@ class PythonPartTestCase(fixture_setup.ProcessorBaseTestCase):
         self.assertEqual(self.part_data.get('python-packages'), None)
         self.assertEqual(self.part_data.get('requirements'),
                          'requirements.txt')
+
+    @patch.object(vendorize.git.Git, 'prepare_branch')
+    @patch('shutil.copytree')
+    @patch('os.path.isdir')
+    @patch('os.listdir')
+    def test_prepare_single_branch(self, mock_listdir, mock_isdir,
+                                   mock_copytree, mock_git):
+        self.processor.python_layout = 'single'
+        folders = [branch.split('_')[-1] for branch in self.branches]
+        mock_listdir.return_value = folders
+        mock_isdir.return_value = True
+        self.plugin.prepare_branches()
+        self.assertEqual(mock_copytree.call_count, len(folders))
+        requirements = os.path.join(self.plugin.copy, 'requirements.txt')
+        with open(requirements) as f:
+            self.assertEqual(f.read().splitlines(), [
+                'git+{}@test_python_packages#subdirectory={}'.format(
+                    self.processor.clone_url, folder)
+                for folder in folders])
+
+
+class PythonLockTestCase(fixture_setup.ProcessorBaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.part_data['plugin'] = 'python'
+        self.processor = self.make_processor(dry_run=False)
+        self.plugin = self.processor.load_plugin(
+            'python', self.data, 'test', '.',
+            os.path.join(self.processor.vendored_source, '.'))
+        self.report = {'install': [
+            {'metadata': {'name': 'foo', 'version': '1.0'},
+             'download_info': {
+                 'url': 'https://example.com/foo-1.0.tar.gz',
+                 'archive_info': {'hash': 'sha256=abc'}}},
+            {'metadata': {'name': 'bar', 'version': '0.1'},
+             'download_info': {
+                 'url': 'https://example.com/bar',
+                 'vcs_info': {'vcs': 'git', 'commit_id': '123'}}},
+        ]}
+
+    @patch('subprocess.check_call')
+    @patch('subprocess.check_output')
+    def test_lock(self, mock_check_output, mock_check_call):
+        mock_check_output.return_value = json.dumps(self.report).encode()
+        for i in range(2):
+            self.plugin.download_packages(['foo', 'bar'])
+        self.assertEqual(mock_check_output.call_count, 1)
+        with open(self.plugin.lock_file()) as f:
+            self.assertEqual(json.load(f)['packages'], [
+                {'name': 'bar', 'version': '0.1',
+                 'url': 'git+https://example.com/bar@123'},
+                {'name': 'foo', 'version': '1.0',
+                 'url': 'https://example.com/foo-1.0.tar.gz',
+                 'sha256': 'abc'}])
+        self.assertEqual(mock_check_call.call_count, 4)
+        hashed = [c for c in mock_check_call.call_args_list
+                  if '--require-hashes' in c[0][0]]
+        self.assertEqual(len(hashed), 2)
+
+        self.plugin.download_packages(['foo'])
+        self.assertEqual(mock_check_output.call_count, 2)
+
+    @patch('subprocess.check_call')
+    @patch('subprocess.check_output')
+    def test_hash_mismatch(self, mock_check_output, mock_check_call):
+        mock_check_output.return_value = json.dumps(self.report).encode()
+
+        def check_call(cmd):
+            if '--require-hashes' in cmd:
+                raise subprocess.CalledProcessError(1, cmd)
+        mock_check_call.side_effect = check_call
+        error = self.assertRaises(vendorize.plugin.PluginError,
+                                  self.plugin.download_packages,
+                                  ['foo', 'bar'])
+        self.assertIn('https://example.com/foo-1.0.tar.gz', error.message)
+
+    @patch('subprocess.check_call')
+    @patch('subprocess.check_output')
+    def test_no_lock(self, mock_check_output, mock_check_call):
+        mock_check_output.side_effect = subprocess.CalledProcessError(1, [])
+        self.plugin.download_packages(['foo', 'bar'])
+        self.assertEqual(mock_check_call.call_count, 2)
+        self.assertFalse(os.path.exists(self.plugin.lock_file()))
@@ -0,0 +1,45 @@
+import fixtures
+import json
+import os
+import testtools
+
+
+import vendorize.schedule
+
+
+class HistoryTestCase(testtools.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        tmpdir = self.useFixture(fixtures.TempDir()).path
+        self.filename = os.path.join(tmpdir, 'snap', 'vendoring',
+                                     'history.json')
+
+    def make_history(self, parts: dict):
+        os.makedirs(os.path.dirname(self.filename))
+        with open(self.filename, 'w') as f:
+            json.dump(parts, f)
+        return vendorize.schedule.History(self.filename)
+
+    def test_no_history(self):
+        history = vendorize.schedule.History(self.filename)
+        self.assertEqual(history.order(['foo', 'bar']), ['foo', 'bar'])
+
+    def test_order(self):
+        history = self.make_history({
+            'small-tarball': {'fetch': 2, 'duration': 3},
+            'huge-tarball': {'fetch': 50, 'duration': 60},
+            'python': {'fetch': 1, 'duration': 40},
+            'go': {'fetch': 1, 'duration': 10},
+        })
+        parts = ['small-tarball', 'python', 'new', 'go', 'huge-tarball']
+        self.assertEqual(history.order(parts), [
+            'new', 'huge-tarball', 'python', 'small-tarball', 'go'])
+
+    def test_record(self):
+        history = vendorize.schedule.History(self.filename)
+        history.record('foo', fetch=1.5, duration=2.25, size=1024)
+        history.save()
+        self.assertEqual(
+            vendorize.schedule.History(self.filename).parts,
+            {'foo': {'fetch': 1.5, 'duration': 2.25, 'size': 1024}})
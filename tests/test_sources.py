@@ -1,5 +1,10 @@
 import tests.fixture_setup
+import click
 import os
+import shutil
+import subprocess
+import tarfile
+from unittest import mock
 
 
 import vendorize
@@ -20,6 +25,8 @@ class SourcesTestCase(tests.fixture_setup.ProcessorBaseTestCase):
         ('tar.xz', dict(part_data={'source': 'foo.tar.xz'}, type='tar')),
         ('tar.gz', dict(part_data={'source': 'foo.tar.gz'}, type='tar')),
         ('tar.bz2', dict(part_data={'source': 'foo.tar.bz2'}, type='tar')),
+        ('tar.zst', dict(part_data={'source': 'foo.tar.zst'}, type='tar')),
+        ('tzst', dict(part_data={'source': 'foo.tzst'}, type='tar')),
     ]
 
     def setUp(self):
@@ -29,3 +36,126 @@ class SourcesTestCase(tests.fixture_setup.ProcessorBaseTestCase):
 
     def test_fetch(self):
         self.assertEqual(self.part_source.type, self.type)
+
+
+class SparseSourcesTestCase(tests.fixture_setup.ProcessorBaseTestCase):
+
+    scenarios = [
+        ('everything', dict(part_data={'source': 'foo.tar.gz'},
+                            patterns=[],
+                            members=['foo/a', 'bar/b', 'LICENSE'])),
+        ('subdir', dict(part_data={'source': 'foo.tar.gz',
+                                   'source-subdir': 'foo'},
+                        patterns=['/foo'],
+                        members=['foo/a'])),
+        ('include', dict(part_data={'source': 'foo.tar.gz',
+                                    'source-subdir': 'foo/',
+                                    'vendoring-include': ['LICENSE']},
+                         patterns=['/foo', '/LICENSE'],
+                         members=['foo/a', 'LICENSE'])),
+        ('exclude', dict(part_data={'source': 'foo.tar.gz',
+                                    'vendoring-exclude': ['bar']},
+                         patterns=['/**', '!/bar'],
+                         members=['foo/a', 'LICENSE'])),
+    ]
+
+    def setUp(self):
+        super().setUp()
+        self.part_source = vendorize.source.PartSource(
+            self.part_data, os.getcwd(), [])
+
+    def test_sparse_patterns(self):
+        self.assertEqual(self.part_source.sparse_patterns(), self.patterns)
+
+    def test_filter_members(self):
+        members = []
+        for name in ['foo-1.0', 'foo-1.0/foo/a', 'foo-1.0/bar/b',
+                     'foo-1.0/LICENSE']:
+            member = tarfile.TarInfo(name)
+            if name == 'foo-1.0':
+                member.type = tarfile.DIRTYPE
+            members.append(member)
+        self.assertEqual(
+            [m.name for m in self.part_source.filter_members(members)],
+            self.members)
+
+
+class SparseCloneTestCase(tests.fixture_setup.ProcessorBaseTestCase):
+
+    def test_upstream_date(self):
+        processor = self.make_processor(dry_run=False)
+        os.makedirs(os.path.join('upstream', 'foo'))
+        with open(os.path.join('upstream', 'foo', 'a'), 'w') as f:
+            f.write('a')
+        processor.git.prepare_branch('upstream', 'master', init=True,
+                                     commit='Upstream', date='1400000000')
+        part_source = vendorize.source.PartSource(
+            {'source': os.path.abspath('upstream'), 'source-type': 'git',
+             'source-subdir': 'foo'}, os.getcwd(), [], reproducible=True)
+        part_source.fetch('dest')
+        self.assertFalse(os.path.exists(os.path.join('dest', '.git')))
+        # Files are checked out, and may be written, after the commit
+        self.assertGreater(vendorize.util.newest_mtime('dest'), 1400000000)
+        processor.reproducible = True
+        self.assertEqual(processor.commit_date('dest', True), '1400000000')
+
+
+class ExtractTestCase(tests.fixture_setup.ProcessorBaseTestCase):
+
+    scenarios = [
+        ('gz decoder', dict(mode='w:gz', decoder=True)),
+        ('xz decoder', dict(mode='w:xz', decoder=True)),
+        ('xz', dict(mode='w:xz', decoder=False)),
+        ('tar', dict(mode='w', decoder=True)),
+        ('zst decoder', dict(mode='w', decoder=True, zstd=True,
+                             archive='foo.tar.zst')),
+    ]
+    zstd = False
+    archive = 'foo.tar'
+
+    def setUp(self):
+        super().setUp()
+        self.part_source = vendorize.source.PartSource(
+            {'source': 'foo.tar'}, os.getcwd(), [])
+        if self.decoder and not shutil.which('zstd' if self.zstd else 'xz'):
+            self.skipTest('The decoder is not available')
+        if not self.decoder:
+            patcher = mock.patch('shutil.which', return_value=None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def make_archive(self, names):
+        os.makedirs('src', exist_ok=True)
+        with tarfile.open('foo.tar', self.mode) as tar:
+            for name in names:
+                path = os.path.join('src', name)
+                if name.endswith('/'):
+                    os.makedirs(path, exist_ok=True)
+                else:
+                    with open(path, 'w') as f:
+                        f.write(name)
+                tar.add(path, arcname=name, recursive=False)
+        if self.zstd:
+            subprocess.check_call(['zstd', '-q', '--rm', 'foo.tar'])
+
+    def test_extract(self):
+        self.make_archive(['foo-1.0/', 'foo-1.0/a/', 'foo-1.0/a/b'])
+        self.part_source.extract(self.archive, 'dest')
+        with open(os.path.join('dest', 'a', 'b')) as f:
+            self.assertEqual(f.read(), 'foo-1.0/a/b')
+
+    def test_extract_no_decoder(self):
+        if not self.zstd:
+            self.skipTest('Archives tarfile can open need no decoder')
+        self.make_archive(['foo-1.0/', 'foo-1.0/a'])
+        with mock.patch('shutil.which', return_value=None):
+            error = self.assertRaises(click.ClickException,
+                                      self.part_source.extract,
+                                      self.archive, 'dest')
+        self.assertEqual(error.message,
+                         "zstd is needed to extract 'foo.tar.zst'")
+
+    def test_extract_no_prefix(self):
+        self.make_archive(['foo-1.0/', 'foo-1.0/a', 'LICENSE'])
+        self.part_source.extract(self.archive, 'dest')
+        self.assertEqual(sorted(os.listdir('dest')), ['LICENSE', 'foo-1.0'])
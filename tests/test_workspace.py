@@ -0,0 +1,70 @@
+import fixtures
+import os
+import testtools
+
+
+import vendorize.workspace
+
+
+class WorkspaceTestCase(testtools.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.folder = os.path.join(
+            self.useFixture(fixtures.TempDir()).path, 'parts')
+        self.workspace = vendorize.workspace.Workspace(self.folder)
+
+    def make_file(self, *path, size=10, mtime=None):
+        filename = os.path.join(self.folder, *path)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'wb') as f:
+            f.write(b'x' * size)
+        if mtime:
+            os.utime(filename, (mtime, mtime))
+        return filename
+
+    def test_verify(self):
+        self.make_file('foo', 'src', 'a')
+        copy = os.path.join(self.folder, 'foo', 'src')
+        self.assertFalse(self.workspace.verify(copy, 'origin'))
+        self.assertEqual(self.workspace.record(copy, 'origin'), 10)
+        self.assertTrue(self.workspace.verify(copy, 'origin'))
+        self.assertFalse(self.workspace.verify(copy, 'other'))
+
+        self.make_file('foo', 'src', 'a', size=5)
+        self.assertFalse(self.workspace.verify(copy, 'origin'))
+
+    def test_manifest(self):
+        self.make_file('foo.tar.gz')
+        archive = os.path.join(self.folder, 'foo.tar.gz')
+        self.workspace.record(archive, 'http://example.com/foo.tar.gz')
+        self.workspace.save()
+        workspace = vendorize.workspace.Workspace(self.folder)
+        self.assertTrue(workspace.verify(
+            archive, 'http://example.com/foo.tar.gz'))
+
+    def test_collect(self):
+        self.make_file('old.tar.gz', size=100, mtime=1000)
+        self.make_file('old.tar.gz.json', size=10, mtime=1000)
+        self.make_file('foo', 'src', 'a', size=100)
+        self.make_file('bar', 'src', 'a', size=100)
+        self.workspace.record(os.path.join(self.folder, 'bar', 'src'))
+        self.workspace.artifacts['bar/src']['used'] = 2000
+
+        self.assertEqual(self.workspace.collect(150), ['old.tar.gz',
+                                                       'bar/src'])
+        self.assertEqual(sorted(os.listdir(self.folder)),
+                         ['bar', 'foo', 'manifest.json'])
+        self.assertEqual(os.listdir(os.path.join(self.folder, 'foo')),
+                         ['src'])
+        self.assertEqual(self.workspace.artifacts, {})
+
+    def test_collect_within_budget(self):
+        self.make_file('old.tar.gz', size=100, mtime=1000)
+        self.assertEqual(self.workspace.collect(100), [])
+
+    def test_parse_size(self):
+        self.assertEqual(vendorize.workspace.parse_size('512'), 512)
+        self.assertEqual(vendorize.workspace.parse_size('10G'), 10 << 30)
+        self.assertEqual(vendorize.workspace.parse_size('2 MiB'), 2 << 20)
+        self.assertRaises(ValueError, vendorize.workspace.parse_size, '1X')
@@ -0,0 +1,45 @@
+import logging
+import os
+import tempfile
+from collections import OrderedDict
+from typing import Dict
+
+
+import vendorize.git
+
+
+def export(git: vendorize.git.Git, branches: Dict[str, str], repo: str,
+           bundle: str):
+    """Writes branches, prepared in the given folders, to a single bundle.
+
+    Branches are gathered in the bare repository repo first, since a
+    bundle can only be created from one repository.
+    """
+    folders = OrderedDict()  # type: Dict[str, list]
+    for branch, folder in branches.items():
+        if os.path.abspath(folder) == os.path.abspath(repo):
+            continue
+        # Local parts are prepared in a subfolder of the vendored source
+        folders.setdefault(git.toplevel(folder), []).append(branch)
+    for folder, names in folders.items():
+        git.fetch_branches(repo, folder, names)
+    git.create_bundle(repo, bundle, list(branches))
+
+
+def publish(git: vendorize.git.Git, bundle: str, target: str,
+            logger: logging.Logger):
+    """Pushes all branches in bundle that the target doesn't have yet in a
+    single transfer."""
+    with tempfile.TemporaryDirectory() as tmp:
+        repo = os.path.join(tmp, 'bundle.git')
+        git.init_bare(repo)
+        branches = git.unbundle(repo, bundle)
+        remote = git.list_remote(target)
+        # Objects of the target aren't known here, only commits compare
+        uploads = [b for b, commit in branches.items()
+                   if remote.get(b) != commit]
+        if uploads:
+            logger.debug('Uploading {}'.format(', '.join(uploads)))
+            git.upload_branches(repo, uploads, target)
+    logger.info('Branches: {} uploaded, {} skipped'.format(
+        len(uploads), len(branches) - len(uploads)))
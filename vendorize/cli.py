@@ -17,10 +17,13 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import click
+import logging
 import os
-import socket
 
-import vendorize.processor
+# Anything else is imported once it's known that this isn't just a client
+import vendorize.client
+import vendorize.log
+import vendorize.util
 
 
 _ALLOWED_HOSTS = [
@@ -31,17 +34,32 @@ _ALLOWED_HOSTS = [
 
 
 def validate_repository(ctx, param, value):
-    for prefix in ['git+ssh://']:
+    if value is None:
+        return None
+    for prefix in ['git+ssh://', 'file://']:
         if value.startswith(prefix):
             return value
+    if vendorize.util.is_bare_repository(value):
+        return os.path.abspath(value)
     raise click.BadParameter('{} is not a recognized URL'.format(value))
 
 
+def validate_size(ctx, param, value):
+    if value is None:
+        return None
+    from vendorize.workspace import parse_size
+    try:
+        return parse_size(value)
+    except ValueError:
+        raise click.BadParameter('{} is not a valid size'.format(value))
+
+
 def validate_host(ctx, param, value):
+    # A daemon validates hosts itself, using the results it has cached
+    if ctx.params.get('daemon'):
+        return list(value)
     for host in value:
-        try:
-            socket.gethostbyname(host)
-        except socket.gaierror:
+        if not vendorize.util.is_resolvable(host):
             raise click.BadParameter('{} is not a valid hostname'.format(host))
     return list(value)
 
@@ -50,12 +68,38 @@ def validate_host(ctx, param, value):
 @click.version_option(version='0.1')
 @click.option('--dry-run', '-n', is_flag=True, help='Just verify what to do')
 @click.option('--debug', '-d', is_flag=True, help='Debug')
+@click.option('--log-format', type=click.Choice(['text', 'json']),
+              envvar='VENDORIZE_LOG_FORMAT', default='text',
+              show_default=True, help='Log as text or a JSON object per line')
 @click.argument('target_repository', callback=validate_repository)
 @click.argument('project_folder',
                 type=click.Path(exists=True), default=os.getcwd())
+@click.option('--reproducible', is_flag=True,
+              help='Make identical sources result in identical commits')
+@click.option('--python-layout', type=click.Choice(['package', 'single']),
+              default='package', show_default=True,
+              help='Vendor python packages to a branch each or a single one')
+@click.option('--staging', is_flag=True,
+              help='Prepare all branches in one shared repository')
+@click.option('--update', is_flag=True,
+              help='Commit on top of branches already in the target')
+@click.option('--jobs', '-j', default=4, show_default=True,
+              help='Number of parts and fetches processed concurrently')
+@click.option('--sync-to', metavar='URL', callback=validate_repository,
+              help='Mirror a local target to this remote in the background')
+@click.option('--bundle', type=click.Path(dir_okay=False),
+              help='Export all branches to a bundle instead of pushing them')
+@click.option('--from-bundle', type=click.Path(exists=True, dir_okay=False),
+              help='Push all branches of an exported bundle and exit')
+@click.option('--disk-budget', metavar='SIZE', callback=validate_size,
+              help='Remove least recently used parts beyond a size like 10G')
+@click.option('--daemon', metavar='SOCKET', envvar='VENDORIZE_DAEMON',
+              is_eager=True, help='Submit the job to a vendorize daemon')
 @click.option('host', '-h', default=_ALLOWED_HOSTS, help='Allowed host',
               metavar='<hosts>', multiple=True, callback=validate_host)
-def run(dry_run, debug, target_repository, project_folder, host):
+def run(dry_run, debug, log_format, target_repository, project_folder,
+        reproducible, python_layout, staging, update, jobs, sync_to, bundle,
+        from_bundle, disk_budget, daemon, host):
     """Vendorize a snap and all its dependencies to a specified repository.
 
     \b
@@ -63,15 +107,36 @@ def run(dry_run, debug, target_repository, project_folder, host):
         vendorize git+ssh://git.launchpad.net/~user
         vendorize git+ssh://git.launchpad.net/~user mysnap
         vendorize -n git+ssh://git.launchpad.net/~user
-        vendorize -n git+ssh://git.launchpad.net/~user
+        vendorize file:///srv/vendoring.git
+        vendorize --sync-to git+ssh://git.launchpad.net/~user /srv/v.git
+        vendorize --bundle mysnap.bundle git+ssh://git.launchpad.net/~user
+        vendorize --from-bundle mysnap.bundle git+ssh://git.launchpad.net/~user
         vendorize -h git.launchpad.net git+ssh://git.launchpad.net/~user
+        vendorize --daemon /run/user/1000/vendorize.sock git+ssh://...
     """
 
-    processor = vendorize.processor.Processor(
+    vendorize.log.set_format(log_format)
+    if from_bundle:
+        from vendorize.bundle import publish
+        from vendorize.git import Git
+        logger = vendorize.log.get_logger(__name__)
+        if debug:
+            logger.setLevel(logging.DEBUG)
+        publish(Git(), from_bundle, target_repository, logger)
+        return
+    options = dict(
         project_folder=os.path.abspath(project_folder),
         target=target_repository,
         dry_run=dry_run, debug=debug,
-        allowed_hosts=host
+        allowed_hosts=host, jobs=jobs, reproducible=reproducible,
+        python_layout=python_layout, staging=staging, update=update,
+        disk_budget=disk_budget, sync=sync_to,
+        bundle=os.path.abspath(bundle) if bundle else None
         )
+    if daemon:
+        vendorize.client.submit(daemon, options)
+        return
+    from vendorize.processor import Processor
+    processor = Processor(**options)
     with processor.discover_snapcraft_yaml() as f:
         processor.process_yaml(f)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- mode: python; -*-
+#
+# Copyright 2018 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This package is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Submits jobs to a vendorize daemon.
+
+Only what's needed to talk to the daemon is imported here, so that the
+command line starts quickly when it's a client.
+"""
+
+import click
+import json
+import os
+import socket
+
+
+import vendorize.log
+
+
+DEFAULT_SOCKET = os.path.join(
+    os.getenv('XDG_RUNTIME_DIR', '/tmp'), 'vendorize.sock')
+
+# Variables of the client that determine the vendored commits
+ENVIRONMENT = ['REAL_NAME', 'EMAIL_ADDRESS', 'SOURCE_DATE_EPOCH']
+
+
+def submit(address: str, job: dict):
+    """Runs job in the daemon listening on address, echoing its log."""
+    colors = vendorize.log.ColoredLogFormatter.colors
+    job = dict(job, environ={k: os.environ[k] for k in ENVIRONMENT
+                             if k in os.environ})
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(address)
+            s.sendall('{}\n'.format(json.dumps(job)).encode())
+            for line in s.makefile('r'):
+                message = json.loads(line)
+                if 'status' in message:
+                    break
+                click.echo('{}{}\033[0m'.format(
+                    colors.get(message['level'], ''), message['message']))
+            else:
+                raise click.ClickException('The daemon quit unexpectedly')
+    except OSError as e:
+        raise click.ClickException(
+            'Cannot connect to {!r}: {}'.format(address, e.strerror))
+    if message['status'] != 'ok':
+        raise click.ClickException(message['message'])
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- mode: python; -*-
+#
+# Copyright 2018 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This package is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""A long-running process vendoring snaps on behalf of clients.
+
+Jobs are submitted over a Unix socket as a single line of JSON with the
+options of the command line. Log messages are sent back as they happen,
+one JSON object per line, followed by the status of the job.
+"""
+
+import click
+import itertools
+import json
+import logging
+import os
+import socketserver
+import threading
+from typing import Callable
+
+
+import vendorize.client
+import vendorize.log
+import vendorize.util
+
+
+# Options a client may pass on to the processor
+_OPTIONS = ['project_folder', 'target', 'allowed_hosts', 'dry_run', 'debug',
+            'jobs', 'reproducible', 'python_layout', 'staging', 'update',
+            'disk_budget', 'bundle', 'sync']
+
+
+class JobLogHandler(logging.Handler):
+    def __init__(self, send: Callable) -> None:
+        super().__init__()
+        self.send = send
+
+    def emit(self, record):
+        try:
+            self.send(level=record.levelname, message=self.format(record))
+        except OSError:
+            # The client is gone, the job still runs to completion
+            pass
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            job = json.loads(self.rfile.readline().decode())
+        except ValueError:
+            self.send(status='error', message='Invalid job')
+            return
+        self.server.daemon.run(job, self.send)
+
+    def send(self, **message):
+        self.wfile.write('{}\n'.format(json.dumps(message)).encode())
+        self.wfile.flush()
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class Daemon:
+    """Runs up to max_jobs jobs at a time, queueing any others.
+
+    Downloads, pip packages, the git identity and host lookups are kept
+    for the lifetime of the daemon and shared by all jobs.
+    """
+    def __init__(self, address: str, *, max_jobs: int=2,
+                 cache_dir: str=None) -> None:
+        self.address = address
+        self.cache_dir = cache_dir
+        self.slots = threading.BoundedSemaphore(max_jobs)
+        self.counter = itertools.count(1)
+        self.logger = vendorize.log.get_logger(__name__)
+        self.server = None  # type: Server
+
+    def serve(self):
+        if os.path.exists(self.address):
+            # Left behind by a previous daemon
+            os.remove(self.address)
+        self.server = Server(self.address, JobHandler)
+        self.server.daemon = self
+        self.logger.info('Listening on {!r}'.format(self.address))
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            os.remove(self.address)
+
+    def shutdown(self):
+        self.server.shutdown()
+
+    def run(self, job: dict, send: Callable):
+        number = next(self.counter)
+        logger = self.job_logger(number, send)
+        logger.info('Job {} queued'.format(number))
+        with self.slots:
+            self.logger.info('Running job {} for {!r}'.format(
+                number, job.get('project_folder')))
+            try:
+                self.process(job, logger)
+            except click.ClickException as e:
+                send(status='error', message=e.format_message())
+                return
+            except Exception as e:
+                self.logger.exception('Job {} failed'.format(number))
+                send(status='error', message=repr(e))
+                return
+        send(status='ok')
+
+    def job_logger(self, number: int, send: Callable) -> logging.Logger:
+        # Not registered globally so that it goes away with the job
+        logger = logging.Logger('{}.job{}'.format(__name__, number),
+                                logging.INFO)
+        logger.addHandler(JobLogHandler(send))
+        return logger
+
+    def process(self, job: dict, logger: logging.Logger):
+        options = {k: v for k, v in job.items() if k in _OPTIONS}
+        for host in options.get('allowed_hosts', []):
+            if not vendorize.util.is_resolvable(host):
+                raise click.BadParameter(
+                    '{} is not a valid hostname'.format(host))
+        # Only the client's environment applies, not that of the daemon
+        environ = {k: v for k, v in job.get('environ', {}).items()
+                   if k in vendorize.client.ENVIRONMENT}
+        # Only needed by the daemon, clients don't load it
+        from vendorize.processor import Processor
+        processor = Processor(
+            cache_dir=self.cache_dir, logger=logger, environ=environ,
+            **options)
+        with processor.discover_snapcraft_yaml() as f:
+            processor.process_yaml(f)
+
+
+@click.command()
+@click.option('--socket', 'address',
+              default=vendorize.client.DEFAULT_SOCKET, show_default=True,
+              help='Unix socket to listen on')
+@click.option('--max-jobs', default=2, show_default=True,
+              help='Number of jobs run concurrently')
+@click.option('--cache-dir', type=click.Path(file_okay=False),
+              default=os.path.join(os.path.expanduser('~'), '.cache',
+                                   'vendorize'),
+              show_default=True, help='Downloads shared by all jobs')
+def serve(address, max_jobs, cache_dir):
+    """Run vendoring jobs submitted with vendorize --daemon."""
+    Daemon(address, max_jobs=max_jobs, cache_dir=cache_dir).serve()
+
+
+if __name__ == '__main__':
+    # Click requires UTF-8 but we have no i18n so just reset the locale
+    os.environ['LC_ALL'] = 'C.UTF-8'
+    serve(prog_name='vendorize-daemon')
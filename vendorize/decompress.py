@@ -0,0 +1,106 @@
+import click
+import contextlib
+import shutil
+import subprocess
+import tarfile
+import tempfile
+from typing import IO, List, Optional
+
+
+# Compression formats by magic number
+_MAGIC = [
+    (b'\x1f\x8b', 'gz'),
+    (b'BZh', 'bz2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'\x28\xb5\x2f\xfd', 'zst'),
+]
+
+# Decoders, most parallel first, writing the decompressed data to stdout
+_DECODERS = {
+    'gz': [['pigz', '-dc'], ['gzip', '-dc']],
+    'bz2': [['lbzip2', '-dc'], ['pbzip2', '-dc'], ['bzip2', '-dc']],
+    'xz': [['xz', '-T0', '-dc']],
+    'zst': [['zstd', '-T0', '-dc']],
+}
+
+
+def compression(archive: str) -> Optional[str]:
+    with open(archive, 'rb') as f:
+        header = f.read(6)
+    for magic, name in _MAGIC:
+        if header.startswith(magic):
+            return name
+    return None
+
+
+def decoder(archive: str) -> Optional[List[str]]:
+    for cmd in _DECODERS.get(compression(archive) or '', []):
+        if shutil.which(cmd[0]):
+            return cmd
+    return None
+
+
+@contextlib.contextmanager
+def open_stream(archive: str):
+    """Yields the decompressed contents of archive as a stream.
+
+    An external decoder runs in a separate process, using as many threads
+    as it supports, while the stream is being read. None is yielded if no
+    such decoder is available for the archive.
+    """
+    cmd = decoder(archive)
+    if not cmd:
+        yield None
+        return
+    with open(archive, 'rb') as f:
+        process = subprocess.Popen(cmd, stdin=f, stdout=subprocess.PIPE,
+                                   stderr=subprocess.DEVNULL)
+    stream = Stream(process)
+    try:
+        yield stream
+    finally:
+        stream.close()
+
+
+class Stream:
+    def __init__(self, process: subprocess.Popen) -> None:
+        self.process = process
+        self.stdout = process.stdout  # type: IO[bytes]
+        self.finished = False
+
+    def read(self, size: int=-1) -> bytes:
+        return self.stdout.read(size)
+
+    def finish(self):
+        # Consume any padding so that the decoder can exit cleanly
+        while self.read(1 << 16):
+            pass
+        self.finished = True
+
+    def close(self):
+        if not self.finished:
+            self.process.kill()
+        self.stdout.close()
+        if self.process.wait() and self.finished:
+            raise tarfile.ReadError(
+                '{} failed'.format(' '.join(self.process.args)))
+
+
+def open_tar(archive: str) -> tarfile.TarFile:
+    """Opens archive for random access, with any compression tarfile
+    doesn't support natively decompressed to a temporary file."""
+    if compression(archive) != 'zst':
+        return tarfile.open(archive)
+    tmp = tempfile.TemporaryFile()
+    with open_stream(archive) as stream:
+        if not stream:
+            raise click.ClickException(
+                'zstd is needed to extract {!r}'.format(archive))
+        shutil.copyfileobj(stream, tmp)
+        stream.finish()
+    tmp.seek(0)
+    return tarfile.open(fileobj=tmp)
+
+
+def pipe(stream: IO[bytes]) -> tarfile.TarFile:
+    return tarfile.open(fileobj=stream, mode='r|')
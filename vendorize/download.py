@@ -0,0 +1,184 @@
+import click
+import http.client
+import json
+import logging
+import os
+import socket
+import time
+import urllib.error
+import urllib.request
+from typing import Callable, Optional
+
+
+# Server errors and throttling are worth retrying, anything else is final
+_RETRY_STATUS = [408, 429, 500, 502, 503, 504]
+
+
+class DownloadError(click.ClickException):
+    """Exception for a download that could not be completed.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+
+class Downloader:
+    """Fetch URLs into a file cache, resuming and revalidating as needed.
+
+    Partial transfers are kept next to the target as '<file>.part' and
+    resumed with an HTTP Range request. Complete downloads are accompanied
+    by a '<file>.json' holding the validators (ETag, Last-Modified) used to
+    revalidate the cached copy before it's used again. A transfer fails if
+    connecting or any read takes longer than timeout seconds.
+    """
+    def __init__(self, *, timeout: float=60,
+                 retries: int=5, backoff: float=1, max_backoff: float=60,
+                 chunk_size: int=1 << 16,
+                 logger: logging.Logger=None,
+                 progress: Callable=None) -> None:
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.chunk_size = chunk_size
+        self.logger = logger or logging.getLogger(__name__)
+        self.sleep = time.sleep
+        # Called with the bytes received so far and the size, if known
+        self.progress = progress
+
+    def fetch(self, url: str, filename: str) -> str:
+        for attempt in range(self.retries + 1):
+            try:
+                self.transfer(url, filename)
+                return filename
+            except (urllib.error.URLError, http.client.HTTPException,
+                    ConnectionError, socket.timeout) as e:
+                if not self.should_retry(e) or attempt == self.retries:
+                    if self.is_cached(filename):
+                        self.logger.warning(
+                            'Using cached {!r}: {}'.format(url, e))
+                        return filename
+                    raise DownloadError(
+                        'Cannot download {!r}: {}'.format(url, e))
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+                self.logger.debug('Retrying {!r} in {}s: {}'.format(
+                    url, delay, e))
+                self.sleep(delay)
+        return filename
+
+    def should_retry(self, error: Exception) -> bool:
+        if isinstance(error, urllib.error.HTTPError):
+            return error.code in _RETRY_STATUS
+        return True
+
+    def is_cached(self, filename: str) -> bool:
+        return (os.path.exists(filename) and
+                self.load_metadata(filename) is not None)
+
+    def transfer(self, url: str, filename: str):
+        partial = filename + '.part'
+        request = urllib.request.Request(url)
+        metadata = self.load_metadata(filename)
+        if metadata and os.path.exists(filename):
+            self.add_validators(request, metadata,
+                                'If-None-Match', 'If-Modified-Since')
+        else:
+            metadata = self.load_metadata(partial)
+            offset = os.path.getsize(partial) if os.path.exists(
+                partial) else 0
+            if metadata and offset:
+                request.add_header('Range', 'bytes={}-'.format(offset))
+                self.add_validators(request, metadata, 'If-Range',
+                                    'If-Range')
+        try:
+            # The timeout applies to connecting and every read
+            response = urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                self.logger.debug('Cached {!r} is up to date'.format(url))
+                return
+            if e.code == 416 and os.path.exists(partial):
+                # The partial file doesn't match the remote file anymore
+                self.remove(partial)
+                return self.transfer(url, filename)
+            raise
+        with response:
+            self.receive(response, url, partial)
+        os.replace(partial, filename)
+        os.replace(partial + '.json', filename + '.json')
+
+    def add_validators(self, request: urllib.request.Request,
+                       metadata: dict, etag_header: str, date_header: str):
+        # Strong validators are preferred, dates are only a fallback
+        if metadata.get('etag'):
+            request.add_header(etag_header, metadata['etag'])
+        elif metadata.get('last-modified'):
+            request.add_header(date_header, metadata['last-modified'])
+
+    def receive(self, response: http.client.HTTPResponse,
+                url: str, partial: str):
+        metadata = {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last-modified': response.headers.get('Last-Modified'),
+        }
+        if response.status == 206:
+            mode = 'ab'
+            offset = os.path.getsize(partial)
+            start, size = self.parse_content_range(
+                response.headers.get('Content-Range', ''))
+            if start != offset:
+                self.remove(partial)
+                raise http.client.HTTPException(
+                    'Unexpected range from {!r}'.format(url))
+        else:
+            mode = 'wb'
+            offset = 0
+            size = self.parse_length(response.headers.get('Content-Length'))
+        metadata['size'] = size
+        self.save_metadata(partial, metadata)
+        self.logger.debug('Downloading {!r} from byte {}'.format(url, offset))
+        received = offset
+        with open(partial, mode) as f:
+            while True:
+                chunk = response.read(self.chunk_size)
+                if not chunk:
+                    break
+                f.write(chunk)
+                received += len(chunk)
+                if self.progress:
+                    self.progress(received, size)
+        if size is not None and received != size:
+            raise http.client.IncompleteRead(b'', size - received)
+
+    def parse_content_range(self, value: str) -> tuple:
+        # bytes 100-199/200
+        try:
+            _, _, spec = value.partition(' ')
+            first_last, _, total = spec.partition('/')
+            start = int(first_last.split('-')[0])
+            size = None if total == '*' else int(total)
+            return start, size
+        except ValueError:
+            return None, None
+
+    def parse_length(self, value: Optional[str]) -> Optional[int]:
+        try:
+            return int(value) if value is not None else None
+        except ValueError:
+            return None
+
+    def load_metadata(self, filename: str) -> Optional[dict]:
+        try:
+            with open(filename + '.json') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save_metadata(self, filename: str, metadata: dict):
+        with open(filename + '.json', 'w') as f:
+            json.dump(metadata, f)
+
+    def remove(self, filename: str):
+        for path in [filename, filename + '.json']:
+            if os.path.exists(path):
+                os.remove(path)
@@ -1,29 +1,43 @@
 import click
+import functools
 import os
 import subprocess
+import threading
+from typing import List, Optional
 
 
-import vendorize.util
+_identity_lock = threading.Lock()
+
+# The commit a repository had before anything was vendored in it
+_UPSTREAM = 'refs/vendorize/upstream'
+
+
+@functools.lru_cache(maxsize=1)
+def configured_identity() -> tuple:
+    # Only probed once per process, long-running ones included
+    try:
+        return (subprocess.check_output([
+                    'git', 'config', 'user.name']).decode().strip(),
+                subprocess.check_output([
+                    'git', 'config', 'user.email']).decode().strip())
+    except subprocess.CalledProcessError:
+        # Values are not set in git
+        return (None, None)
 
 
 class Git:
-    def __init__(self) -> None:
-        name = os.getenv('REAL_NAME')
-        email = os.getenv('EMAIL_ADDRESS')
+    def __init__(self, environ: dict=None) -> None:
+        # The identity may come from the environment of another process
+        if environ is None:
+            environ = dict(os.environ)
+        name = environ.get('REAL_NAME')
+        email = environ.get('EMAIL_ADDRESS')
         if not (name and email):
-            name = None
-            email = None
-            try:
-                name = subprocess.check_output([
-                    'git', 'config', 'user.name']).decode()
-                email = subprocess.check_output([
-                    'git', 'config', 'user.email']).decode()
-            except subprocess.CalledProcessError:
-                # Values are not set in git
-                pass
+            name, email = configured_identity()
         if name and email:
             self.name = name
             self.email = email
+            self.identity_set = False
         else:
             raise click.ClickException(
                 'You need to set REAL_NAME and EMAIL_ADDRESS')
@@ -38,40 +52,385 @@ class Git:
             else:
                 raise click.ClickException('No SSH configuration found')
 
-    def clone(self, source: str, folder: str, branch: str=None):
+    def clone(self, source: str, folder: str, branch: str=None,
+              *, jobs: int=None, sparse: List[str]=None):
         try:
-            cmd = ['git', 'clone', '--recursive', source, folder]
+            cmd = ['git', 'clone', source, folder]
             if branch:
                 cmd += ['--branch', branch]
+            if sparse:
+                # Only fetch blobs of the latest commit that are checked out
+                cmd += ['--depth', '1', '--filter=blob:none', '--no-checkout']
             subprocess.check_call(cmd)
         except subprocess.CalledProcessError as e:
             raise click.ClickException(' '.join(e.cmd))
+        if sparse:
+            self.sparse_checkout(folder, sparse)
+            # Only submodules within the checked out paths are wanted
+            paths = self.checked_out_submodules(folder)
+            if paths:
+                self.update_submodules(folder, jobs=jobs, paths=paths)
+        elif os.path.exists(os.path.join(folder, '.gitmodules')):
+            self.update_submodules(folder, jobs=jobs)
+
+    def sparse_checkout(self, folder: str, patterns: List[str]):
+        try:
+            subprocess.check_call(['git', 'sparse-checkout', 'set',
+                                   '--no-cone'] + patterns, cwd=folder)
+            subprocess.check_call(['git', 'checkout'], cwd=folder)
+        except subprocess.CalledProcessError as e:
+            raise click.ClickException(' '.join(e.cmd))
+
+    def checked_out_submodules(self, folder: str) -> List[str]:
+        try:
+            entries = subprocess.check_output(
+                ['git', 'ls-files', '--stage', '-t'], cwd=folder).decode()
+        except subprocess.CalledProcessError as e:
+            raise click.ClickException(' '.join(e.cmd))
+        paths = []
+        for line in entries.splitlines():
+            info, path = line.split('\t', 1)
+            # Paths outside of a sparse checkout are tagged S
+            tag, mode = info.split(' ')[:2]
+            if tag == 'H' and mode == '160000':
+                paths.append(path)
+        return paths
+
+    def update_submodules(self, folder: str, *, jobs: int=None,
+                          paths: List[str]=None):
+        # Fetch all submodules, including nested ones, concurrently
+        try:
+            cmd = ['git', 'submodule', 'update', '--init', '--recursive']
+            if jobs:
+                cmd += ['--jobs', str(jobs)]
+            if paths:
+                cmd += ['--'] + paths
+            subprocess.check_call(cmd, cwd=folder)
+        except subprocess.CalledProcessError as e:
+            raise click.ClickException(' '.join(e.cmd))
+
+    def list_submodules(self, folder: str) -> list:
+        """Returns a (name, path, url) tuple for each submodule."""
+        gitmodules = os.path.join(folder, '.gitmodules')
+        if not os.path.exists(gitmodules):
+            return []
+        submodules = []
+        try:
+            paths = subprocess.check_output([
+                'git', 'config', '-f', gitmodules,
+                '--get-regexp', r'^submodule\..*\.path$']).decode()
+            for line in paths.splitlines():
+                key, path = line.split(' ', 1)
+                name = key[len('submodule.'):-len('.path')]
+                url = subprocess.check_output([
+                    'git', 'config', '-f', gitmodules,
+                    'submodule.{}.url'.format(name)]).decode().strip()
+                submodules.append((name, path, url))
+        except subprocess.CalledProcessError as e:
+            raise click.ClickException(' '.join(e.cmd))
+        return submodules
+
+    def set_submodule(self, folder: str, name: str, url: str, branch: str):
+        gitmodules = os.path.join(folder, '.gitmodules')
+        try:
+            for key, value in [('url', url), ('branch', branch)]:
+                subprocess.check_call([
+                    'git', 'config', '-f', gitmodules,
+                    'submodule.{}.{}'.format(name, key), value])
+        except subprocess.CalledProcessError as e:
+            raise click.ClickException(' '.join(e.cmd))
+
+    def head(self, folder: str) -> str:
+        try:
+            return subprocess.check_output([
+                'git', 'rev-parse', 'HEAD'], cwd=folder).decode().strip()
+        except subprocess.CalledProcessError as e:
+            raise click.ClickException(' '.join(e.cmd))
+
+    def checkout_branch(self, folder: str, source: str, branch: str):
+        # Check out a branch prepared in another clone of the same repo
+        try:
+            subprocess.check_call(['git', 'fetch', source, branch],
+                                  cwd=folder)
+            subprocess.check_call(['git', 'checkout', '--detach',
+                                   'FETCH_HEAD'], cwd=folder)
+        except subprocess.CalledProcessError as e:
+            raise click.ClickException(' '.join(e.cmd))
 
     def prepare_branch(self, folder: str, branch: str,
-                       *, init=False, commit: str=None):
+                       *, init=False, commit: str=None, date: str=None,
+                       previous: str=None):
+        """Prepare branch in folder, optionally committing all changes.
+
+        If date, seconds since the epoch, is given the commit is made with
+        a fixed identity and date so that the same contents always result
+        in the same commit. If the repository previous already has branch
+        the commit is made on top of it, so that only changes need to be
+        uploaded again.
+
+        Unless init, the branch is always based on the upstream commit of
+        folder, not on anything vendored in it before, and new repositories
+        have no parent at all.
+        """
         try:
-            with vendorize.util.chdir(folder):
-                if init:
-                    subprocess.check_call(['git', 'init'])
-                subprocess.check_call(['git', 'checkout', '-B', branch])
-                if commit:
-                    self.set_identity()
-                    subprocess.check_call(['git', 'add', '--all'])
-                    subprocess.check_call(['git', 'commit', '--allow-empty',
-                                           '-m', commit])
+            parent = None
+            if init:
+                subprocess.check_call(['git', 'init'], cwd=folder)
+            else:
+                parent = self.upstream(folder)
+            subprocess.check_call(['git', 'checkout', '-B', branch],
+                                  cwd=folder)
+            if commit:
+                parent = self.commit_all(folder, commit, parent, date=date,
+                                         previous=previous, branch=branch)
+            if parent:
+                subprocess.check_call(['git', 'update-ref',
+                                       'refs/heads/' + branch, parent],
+                                      cwd=folder)
         except subprocess.CalledProcessError as e:
             raise click.ClickException(' '.join(e.cmd))
 
-    def upload_branch(self, folder: str, branch: str, target: str):
+    def upstream(self, folder: str) -> Optional[str]:
+        commit = self.resolve(folder, _UPSTREAM)
+        if not commit:
+            # Recorded the first time, later runs have vendored on top
+            commit = self.resolve(folder, 'HEAD')
+            if commit:
+                subprocess.check_call(['git', 'update-ref', _UPSTREAM,
+                                       commit], cwd=folder)
+        return commit
+
+    def commit_all(self, folder: str, message: str, parent: Optional[str],
+                   *, branch: str, date: str=None,
+                   previous: str=None) -> str:
+        env = self.commit_env(date)
+        base = None
+        if previous:
+            base = self.fetch_branch(folder, previous, branch)
+        subprocess.check_call(['git', 'add', '--all'], cwd=folder)
+        return self.write_commit(folder, env, message, [base, parent], base)
+
+    def write_commit(self, folder: str, env: dict, message: str,
+                     parents: list, base: Optional[str]) -> str:
+        """Commit the index, unless it's the same as in base."""
+        tree = subprocess.check_output(
+            ['git', 'write-tree'], env=env, cwd=folder).decode().strip()
+        if base and tree == self.resolve(folder, base + '^{tree}', env):
+            return base
+        cmd = ['git', 'commit-tree', '--no-gpg-sign', '-m', message]
+        unique = []  # type: list
+        for parent in parents:
+            if parent and parent not in unique:
+                unique.append(parent)
+                cmd += ['-p', parent]
+        return subprocess.check_output(
+            cmd + [tree], env=env, cwd=folder).decode().strip()
+
+    def fetch_branch(self, folder: str, repo: str, branch: str,
+                     env: dict=None) -> Optional[str]:
+        try:
+            subprocess.check_call(['git', 'fetch', '-q', '--no-tags', repo,
+                                   'refs/heads/' + branch], env=env,
+                                  cwd=folder, stderr=subprocess.DEVNULL)
+        except subprocess.CalledProcessError:
+            # The branch wasn't vendored before
+            return None
+        return self.resolve(folder, 'FETCH_HEAD', env)
+
+    def resolve(self, folder: str, ref: str,
+                env: dict=None) -> Optional[str]:
         try:
-            with vendorize.util.chdir(folder):
-                subprocess.check_call(['git', 'push', '-u',
-                                       target, branch])
+            return subprocess.check_output(
+                ['git', 'rev-parse', '--verify', '-q', ref],
+                env=env, cwd=folder).decode().strip()
+        except subprocess.CalledProcessError:
+            return None
+
+    def commit_env(self, date: Optional[str]) -> dict:
+        if not date:
+            self.set_identity()
+        # The global configuration may be that of another job
+        return self.identity_env(date)
+
+    def identity_env(self, date: str=None) -> dict:
+        env = dict(os.environ)
+        for role in ['AUTHOR', 'COMMITTER']:
+            env['GIT_{}_NAME'.format(role)] = self.name
+            env['GIT_{}_EMAIL'.format(role)] = self.email
+            if date:
+                env['GIT_{}_DATE'.format(role)] = '@{} +0000'.format(date)
+        return env
+
+    def commit_date(self, folder: str) -> str:
+        try:
+            return subprocess.check_output([
+                'git', 'log', '-1', '--format=%ct',
+                self.resolve(folder, _UPSTREAM) or 'HEAD'],
+                cwd=folder).decode().strip()
+        except subprocess.CalledProcessError as e:
+            raise click.ClickException(' '.join(e.cmd))
+
+    def init_bare(self, repo: str):
+        if os.path.exists(repo):
+            return
+        try:
+            subprocess.check_call(['git', 'init', '--bare', '-q', repo])
+        except subprocess.CalledProcessError as e:
+            raise click.ClickException(' '.join(e.cmd))
+
+    def stage_branch(self, repo: str, folder: str, branch: str,
+                     *, init=False, commit: str=None, date: str=None,
+                     previous: str=None):
+        """Prepare branch in the bare repository repo from folder.
+
+        Unlike prepare_branch this doesn't modify folder: its HEAD, if it
+        is a repository, is fetched into repo and any commit is made using
+        a separate index. Objects are thus shared by all staged branches.
+        """
+        parent = None
+        try:
+            if not init:
+                folder = self.toplevel(folder)
+                parent = self.fetch_head(repo, folder)
+            if commit:
+                parent = self.commit_tree(repo, folder, branch, parent,
+                                          commit, date, previous)
+            subprocess.check_call(['git', '--git-dir', repo, 'update-ref',
+                                   'refs/heads/' + branch, parent])
+        except subprocess.CalledProcessError as e:
+            raise click.ClickException(' '.join(e.cmd))
+
+    def commit_tree(self, repo: str, folder: str, branch: str,
+                    parent: Optional[str], message: str,
+                    date: Optional[str], previous: Optional[str]) -> str:
+        env = self.commit_env(date)
+        index = os.path.join(repo, 'index.{}'.format(branch))
+        env.update({'GIT_DIR': repo, 'GIT_WORK_TREE': folder,
+                    'GIT_INDEX_FILE': index})
+        base = None
+        if previous:
+            base = self.fetch_branch(folder, previous, branch, env)
+        try:
+            # Keep tracked files, even if they're ignored
+            if parent:
+                subprocess.check_call(['git', 'read-tree', parent],
+                                      env=env, cwd=folder)
+            subprocess.check_call(['git', 'add', '--all'], env=env,
+                                  cwd=folder)
+            return self.write_commit(folder, env, message, [base, parent],
+                                     base)
+        finally:
+            if os.path.exists(index):
+                os.remove(index)
+
+    def fetch_head(self, repo: str, folder: str) -> str:
+        subprocess.check_call(['git', '--git-dir', repo, 'fetch', '-q',
+                               '--no-tags', folder, 'HEAD'])
+        return subprocess.check_output([
+            'git', '--git-dir', repo, 'rev-parse',
+            'FETCH_HEAD']).decode().strip()
+
+    def toplevel(self, folder: str) -> str:
+        return subprocess.check_output([
+            'git', 'rev-parse', '--show-toplevel'],
+            cwd=folder).decode().strip()
+
+    def upload_branches(self, folder: str, branches: List[str], target: str):
+        # All branches are sent in a single pack
+        try:
+            subprocess.check_call(['git', 'push', '-u', target] + branches,
+                                  cwd=folder)
+        except subprocess.CalledProcessError as e:
+            raise click.ClickException(' '.join(e.cmd))
+
+    def fetch_branches(self, repo: str, folder: str, branches: List[str]):
+        # Copy branches prepared in folder to the bare repository repo
+        try:
+            subprocess.check_call(
+                ['git', '--git-dir', repo, 'fetch', '-q', '--no-tags',
+                 folder] + ['+refs/heads/{0}:refs/heads/{0}'.format(b)
+                            for b in branches])
+        except subprocess.CalledProcessError as e:
+            raise click.ClickException(' '.join(e.cmd))
+
+    def create_bundle(self, repo: str, bundle: str, branches: List[str]):
+        try:
+            subprocess.check_call(
+                ['git', '--git-dir', repo, 'bundle', 'create', '-q',
+                 os.path.abspath(bundle)] +
+                ['refs/heads/' + b for b in branches])
+        except subprocess.CalledProcessError as e:
+            raise click.ClickException(' '.join(e.cmd))
+
+    def unbundle(self, repo: str, bundle: str) -> dict:
+        """Fetches all branches of bundle into the bare repository repo and
+        returns the commit of each of them."""
+        try:
+            subprocess.check_call(
+                ['git', '--git-dir', repo, 'fetch', '-q', '--no-tags',
+                 os.path.abspath(bundle), '+refs/heads/*:refs/heads/*'])
+            output = subprocess.check_output(
+                ['git', 'bundle', 'list-heads',
+                 os.path.abspath(bundle)]).decode()
+        except subprocess.CalledProcessError as e:
+            raise click.ClickException(' '.join(e.cmd))
+        branches = {}
+        for line in output.splitlines():
+            commit, ref = line.split(' ', 1)
+            if ref.startswith('refs/heads/'):
+                branches[ref[len('refs/heads/'):]] = commit
+        return branches
+
+    def sync(self, repo: str, remote: str) -> subprocess.Popen:
+        """Pushes all branches of the bare repository repo to remote.
+
+        The push runs in its own session so that it can finish after this
+        process has exited. Its output is appended to sync.log in repo.
+        """
+        with open(os.path.join(repo, 'sync.log'), 'ab') as log:
+            return subprocess.Popen(
+                ['git', '--git-dir', repo, 'push', '--quiet', remote,
+                 'refs/heads/*:refs/heads/*'],
+                stdin=subprocess.DEVNULL, stdout=log,
+                stderr=subprocess.STDOUT, start_new_session=True)
+
+    def list_remote(self, target: str) -> dict:
+        """Returns the commit of each branch in the target repository."""
+        try:
+            output = subprocess.check_output([
+                'git', 'ls-remote', '--heads', target]).decode()
+        except subprocess.CalledProcessError:
+            # The repository doesn't exist yet, pushing will create it
+            return {}
+        branches = {}
+        for line in output.splitlines():
+            commit, ref = line.split('\t', 1)
+            branches[ref[len('refs/heads/'):]] = commit
+        return branches
+
+    def rev_parse(self, folder: str, ref: str) -> str:
+        try:
+            return subprocess.check_output([
+                'git', 'rev-parse', '--verify', ref],
+                cwd=folder).decode().strip()
         except subprocess.CalledProcessError as e:
             raise click.ClickException(' '.join(e.cmd))
 
+    def is_same_tree(self, folder: str, commit: str, other: str) -> bool:
+        if commit == other:
+            return True
+        # Trees can only be compared if the other commit is known locally
+        trees = [self.resolve(folder, '{}^{{tree}}'.format(ref))
+                 for ref in [commit, other]]
+        return trees[0] is not None and trees[0] == trees[1]
+
     def set_identity(self):
-        subprocess.check_call(['git', 'config', '--global',
-                               'user.name', self.name])
-        subprocess.check_call(['git', 'config', '--global',
-                               'user.email', self.email])
+        # The global configuration can only be written by one at a time
+        with _identity_lock:
+            if self.identity_set:
+                return
+            subprocess.check_call(['git', 'config', '--global',
+                                   'user.name', self.name])
+            subprocess.check_call(['git', 'config', '--global',
+                                   'user.email', self.email])
+            self.identity_set = True
@@ -1,5 +1,11 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
 import sys
+import threading
 
 
 class ColoredLogFormatter(logging.Formatter):
@@ -20,11 +26,117 @@ class ColoredLogFormatter(logging.Formatter):
         return message
 
 
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per line, for log collectors."""
+    def format(self, record):
+        return json.dumps({
+            'time': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        })
+
+
+class StatusHandler(logging.StreamHandler):
+    """Writes messages above a status line that's kept at the bottom.
+
+    Records with a status attribute replace the status line instead.
+    """
+    def __init__(self, stream) -> None:
+        super().__init__(stream=stream)
+        self.status = ''
+
+    def handle(self, record):
+        status = getattr(record, 'status', None)
+        if status is None:
+            return super().handle(record)
+        self.set_status(status)
+        return True
+
+    def emit(self, record):
+        self.clear()
+        super().emit(record)
+        self.draw()
+
+    def set_status(self, status: str):
+        with self.lock:
+            self.clear()
+            self.status = status
+            self.draw()
+
+    def clear(self):
+        if self.status:
+            self.stream.write('\r\033[K')
+
+    def draw(self):
+        if self.status:
+            self.stream.write(self.status)
+            self.stream.flush()
+
+
+# Messages are queued by the threads logging them and written by a single
+# listener thread, so that a slow output doesn't hold up any work.
+_queue = queue.Queue()  # type: queue.Queue
+_handler = StatusHandler(sys.stdout)
+_handler.setFormatter(JsonLogFormatter()
+                      if os.getenv('VENDORIZE_LOG_FORMAT') == 'json'
+                      else ColoredLogFormatter())
+_listener = None  # type: logging.handlers.QueueListener
+_lock = threading.Lock()
+
+
+def set_format(name: str):
+    """Selects the 'text' or 'json' format of all log messages."""
+    _handler.setFormatter(JsonLogFormatter() if name == 'json'
+                          else ColoredLogFormatter())
+
+
+def start():
+    global _listener
+    with _lock:
+        if _listener:
+            return
+        _listener = logging.handlers.QueueListener(_queue, _handler)
+        _listener.start()
+        atexit.register(stop)
+
+
+def stop():
+    """Writes all queued messages and stops the listener."""
+    global _listener
+    with _lock:
+        if _listener:
+            _listener.stop()
+            _listener = None
+
+
+def is_interactive() -> bool:
+    return _handler.stream.isatty() and not isinstance(
+        _handler.formatter, JsonLogFormatter)
+
+
+def set_status(status: str):
+    # Only shown on a terminal, where it can be redrawn in place
+    if is_interactive():
+        start()
+        _queue.put(logging.makeLogRecord({'name': __name__,
+                                          'status': status}))
+
+
+def echo(name: str, message: str):
+    """Writes message regardless of the level of any logger."""
+    start()
+    _queue.put(logging.makeLogRecord({
+        'name': name, 'msg': message, 'levelname': 'INFO',
+        'levelno': logging.INFO}))
+
+
 def get_logger(name: str):
     logger = logging.getLogger(name)
-    formatter = ColoredLogFormatter()
-    for stream in [sys.stdout]:
-        handler = logging.StreamHandler(stream=stream)
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
+    start()
+    with _lock:
+        # Loggers are shared, so they only need a handler once
+        if not any(isinstance(h, logging.handlers.QueueHandler)
+                   for h in logger.handlers):
+            logger.addHandler(logging.handlers.QueueHandler(_queue))
     return logger
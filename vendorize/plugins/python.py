@@ -1,7 +1,13 @@
+import concurrent.futures
+import hashlib
+import json
 import os
 import setuptools
 import subprocess
 import shutil
+import sys
+import tempfile
+from typing import Optional
 
 
 import vendorize.plugin
@@ -18,6 +24,7 @@ class Python(vendorize.plugin.Plugin):
         self.download_packages(self.get_packages())
         self.unpack_archives()
         self.prepare_branches()
+        self.processor.workspace.record(self.python_cache)
 
     def get_packages(self) -> list:
         python_packages = self.data.get('python-packages', [])
@@ -38,6 +45,30 @@ class Python(vendorize.plugin.Plugin):
         return python_packages
 
     def download_packages(self, python_packages: list):
+        if not python_packages:
+            return
+        # The closure of all packages is only resolved if they changed
+        packages = self.load_lock(python_packages)
+        if packages is None:
+            packages = self.resolve(python_packages)
+            if packages is None:
+                self.download_unlocked(python_packages)
+                return
+            self.save_lock(python_packages, packages)
+        self.download_locked(packages)
+
+    def pip_options(self) -> list:
+        options = [
+            '--no-binary=:all:', '-q',
+            '--exists-action=i',  # ignore
+            '--dest={}'.format(self.python_cache),
+            '--src={}'.format(self.python_cache)]
+        if self.processor.cache_dir:
+            options.append('--cache-dir={}'.format(
+                os.path.join(self.processor.cache_dir, 'pip')))
+        return options
+
+    def download_unlocked(self, python_packages: list):
         # Download packages one by one so that errors related to build
         # dependencies that we don't care about here can be safely ignored.
         self.debug('Fetching: {}'.format(', '.join(python_packages)))
@@ -45,17 +76,114 @@ class Python(vendorize.plugin.Plugin):
             # Downloaded wheels/ archives are saved to the current folder
             try:
                 subprocess.check_call([
-                    'python3', '-m', 'pip',
-                    'download', '--no-binary=:all:', '-q',
-                    '--exists-action=i',  # ignore
-                    '--dest={}'.format(self.python_cache),
-                    '--src={}'.format(self.python_cache)] +
-                    package.split(' '))
+                    'python3', '-m', 'pip', 'download'] +
+                    self.pip_options() + package.split(' '))
             except subprocess.CalledProcessError as e:
                 # Errors in setup.py due to for example pkg-config being run
                 # can be ignored since we're not looking to build anything.
                 self.debug('Error during download: {!r}'.format(e))
 
+    def lock_file(self) -> str:
+        return os.path.join(self.processor.project_folder, 'snap',
+                            'vendoring', 'python', '{}.lock'.format(
+                                self.part))
+
+    def lock_digest(self, python_packages: list) -> str:
+        # The closure depends on the requested packages and the interpreter
+        return hashlib.sha256(json.dumps({
+            'packages': python_packages,
+            'python': list(sys.version_info[:2]),
+        }, sort_keys=True).encode()).hexdigest()
+
+    def load_lock(self, python_packages: list) -> Optional[list]:
+        try:
+            with open(self.lock_file()) as f:
+                lock = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if lock.get('digest') != self.lock_digest(python_packages):
+            self.debug('Requirements changed since {!r}'.format(
+                self.lock_file()))
+            return None
+        return lock.get('packages')
+
+    def save_lock(self, python_packages: list, packages: list):
+        os.makedirs(os.path.dirname(self.lock_file()), exist_ok=True)
+        with open(self.lock_file(), 'w') as f:
+            json.dump({'digest': self.lock_digest(python_packages),
+                       'packages': packages}, f, indent=2, sort_keys=True)
+
+    def resolve(self, python_packages: list) -> Optional[list]:
+        """Returns the pinned closure of python_packages.
+
+        Each package has a name, version and URL, and the SHA256 of the
+        archive unless it comes from version control.
+        """
+        self.debug('Resolving: {}'.format(', '.join(python_packages)))
+        try:
+            output = subprocess.check_output([
+                'python3', '-m', 'pip', 'install', '--dry-run',
+                '--ignore-installed', '--no-binary=:all:', '-q',
+                '--report', '-'] + [
+                    arg for package in python_packages
+                    for arg in package.split(' ')])
+            report = json.loads(output.decode())
+        except (subprocess.CalledProcessError, ValueError) as e:
+            # Packages are downloaded one by one instead
+            self.debug('Error during resolution: {!r}'.format(e))
+            return None
+        return sorted([self.pin(item) for item in report.get('install', [])],
+                      key=lambda package: package['name'])
+
+    def pin(self, item: dict) -> dict:
+        info = item['download_info']
+        package = {'name': item['metadata']['name'],
+                   'version': item['metadata']['version']}
+        vcs_info = info.get('vcs_info')
+        if vcs_info:
+            package['url'] = '{}+{}@{}'.format(
+                vcs_info['vcs'], info['url'], vcs_info['commit_id'])
+            return package
+        package['url'] = info['url']
+        archive_info = info.get('archive_info', {})
+        digest = archive_info.get('hashes', {}).get('sha256')
+        if not digest and archive_info.get('hash', '').startswith('sha256='):
+            digest = archive_info['hash'][len('sha256='):]
+        if digest:
+            package['sha256'] = digest
+        return package
+
+    def download_locked(self, packages: list):
+        # No resolution is needed, so all packages can be fetched at once
+        self.debug('Fetching: {}'.format(', '.join(
+            '{}=={}'.format(p['name'], p['version']) for p in packages)))
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.processor.jobs) as executor:
+            for future in [executor.submit(self.download_pinned, package)
+                           for package in packages]:
+                future.result()
+
+    def download_pinned(self, package: dict):
+        requirement = '{} @ {}'.format(package['name'], package['url'])
+        options = ['--no-deps']
+        if 'sha256' in package:
+            requirement += ' --hash=sha256:{}'.format(package['sha256'])
+            options.append('--require-hashes')
+        # Hashes can only be given in a requirements file
+        with tempfile.NamedTemporaryFile('w', suffix='.txt') as f:
+            f.write('{}\n'.format(requirement))
+            f.flush()
+            try:
+                subprocess.check_call([
+                    'python3', '-m', 'pip', 'download'] + options +
+                    self.pip_options() + ['-r', f.name])
+            except subprocess.CalledProcessError:
+                # Without dependencies nothing unrelated can fail, so the
+                # pinned archive itself is missing or doesn't match
+                raise vendorize.plugin.PluginError(
+                    'Cannot download {!r} from {!r}'.format(
+                        package['name'], package['url']))
+
     def unpack_archives(self):
         # Unpack all archives, skip folders of "editable" packages.
         python_packages = [
@@ -68,18 +196,14 @@ class Python(vendorize.plugin.Plugin):
             shutil.unpack_archive(filename, self.python_cache)
 
     def prepare_branches(self):
-        # Prepare a branch for each folder
-        branches = []  # type: list
         sources = [
             d for d in os.listdir(self.python_cache)
             if os.path.isdir(os.path.join(self.python_cache, d))]
         self.debug('Branching: {}'.format(', '.join(sources)))
-        for package in sources:
-            copy = os.path.join(self.python_cache, package)
-            path = [self.part, 'python_packages', package]
-            branches.append('git+{}'.format(self.processor.prepare_source(
-                path, copy, init=True,
-                commit='Vendor {}'.format(package))))
+        if self.processor.python_layout == 'single':
+            branches = self.prepare_single_branch(sources)
+        else:
+            branches = self.prepare_package_branches(sources)
         filename = os.path.join(self.copy, 'requirements.txt')
         with open(filename, 'w') as f:
             for requirement in branches:
@@ -88,6 +212,33 @@ class Python(vendorize.plugin.Plugin):
         if 'python-packages' in self.data:
             del self.data['python-packages']
 
+    def prepare_package_branches(self, sources: list) -> list:
+        # Prepare a branch for each folder
+        branches = []  # type: list
+        for package in sources:
+            copy = os.path.join(self.python_cache, package)
+            path = [self.part, 'python_packages', package]
+            branches.append('git+{}'.format(self.processor.prepare_source(
+                path, copy, init=True,
+                commit='Vendor {}'.format(package))))
+        return branches
+
+    def prepare_single_branch(self, sources: list) -> list:
+        # Prepare one branch with a folder for each package
+        copy = os.path.join(self.part_dir, 'python-vendored')
+        if os.path.exists(copy):
+            shutil.rmtree(copy)
+        os.makedirs(copy)
+        for package in sources:
+            shutil.copytree(os.path.join(self.python_cache, package),
+                            os.path.join(copy, package), symlinks=True,
+                            ignore=shutil.ignore_patterns('.git'))
+        url = self.processor.prepare_source(
+            [self.part, 'python_packages'], copy, init=True,
+            commit='Vendor python packages')
+        return ['git+{}#subdirectory={}'.format(url, package)
+                for package in sorted(sources)]
+
     def packages_from_setup_py(self):
         setup_py = os.path.join(self.source, 'setup.py')
         if not os.path.exists(setup_py):
@@ -18,45 +18,94 @@
 
 import click
 from collections import OrderedDict
+import concurrent.futures
 import contextlib
+import functools
 import importlib
 import logging
+import threading
+import time
 import yaml
 import os
 from typing import Any, Dict, IO, List
 
 
+import vendorize.bundle
 import vendorize.git
 import vendorize.log
+import vendorize.progress
+import vendorize.schedule
 import vendorize.source
+import vendorize.util
+import vendorize.workspace
 
 
 class Processor:
     def __init__(self, *,
                  project_folder: str, target: str,
                  allowed_hosts: List[str],
-                 dry_run: bool, debug: bool) -> None:
+                 dry_run: bool, debug: bool, jobs: int=1,
+                 reproducible: bool=False,
+                 python_layout: str='package',
+                 staging: bool=False, update: bool=False,
+                 cache_dir: str=None, disk_budget: int=None,
+                 bundle: str=None, sync: str=None,
+                 logger: logging.Logger=None, environ: dict=None) -> None:
         self.project_folder = project_folder
+        # Identity and SOURCE_DATE_EPOCH, which a daemon gets from the client
+        self.environ = environ
         self.target = target
-        self.clone_url = target.replace('git+ssh://', 'https://')
+        # A local target may be mirrored to the remote sources refer to
+        self.sync = sync
+        self.clone_url = vendorize.util.clone_url(sync or target)
         self.allowed_hosts = allowed_hosts
         self.dry_run = dry_run
+        self.jobs = jobs
+        self.reproducible = reproducible
+        self.python_layout = python_layout
+        # Vendored branches may be based on those in the target
+        self.previous = self.target if update else None
+        # Downloads may be shared with other projects
+        self.cache_dir = cache_dir
+        self.disk_budget = disk_budget
+        # Branches may be exported instead of pushed to the target
+        self.bundle = bundle
 
-        self.logger = vendorize.log.get_logger(__name__)
+        self.logger = logger or vendorize.log.get_logger(__name__)
         if debug:
             self.logger.setLevel(logging.DEBUG)
 
-        self.git = vendorize.git.Git()
+        self.git = vendorize.git.Git(environ)
         self.branches = {}  # type: dict
+        # Vendored submodules shared across parts by URL and commit
+        self.submodules = {}  # type: dict
+        self.submodules_lock = threading.Lock()
+        self.locks = {}  # type: Dict[str, threading.Lock]
+        self.lock = threading.Lock()
+        self.history = vendorize.schedule.History(os.path.join(
+            self.project_folder, 'snap', 'vendoring', 'history.json'))
+        self.workspace = vendorize.workspace.Workspace(
+            os.path.join(self.project_folder, 'parts'))
+        self.progress = vendorize.progress.Progress(0)
 
-        if vendorize.util.host_not_vendorized(self.target, self.allowed_hosts):
+        if vendorize.util.host_not_vendorized(self.sync or self.target,
+                                              self.allowed_hosts):
             raise click.UsageError(
                 '{!r} is not in the allowed hosts'.format(self.clone_url))
+        if self.sync and not vendorize.util.is_local(self.target):
+            raise click.UsageError('Only local targets can be synced')
+        if vendorize.util.is_local(self.target) and not self.dry_run:
+            self.git.init_bare(vendorize.util.local_path(self.target))
 
         self.vendored_source = os.path.join(
             self.project_folder, 'snap', 'vendoring', 'src')
         if not self.dry_run:
             os.makedirs(self.vendored_source, exist_ok=True)
+        # Branches can be prepared in one repository sharing all objects
+        self.staging = os.path.join(
+            self.project_folder, 'parts', 'vendoring.git') if staging else None
+        if self.staging and not self.dry_run:
+            self.git.init_bare(self.staging)
 
     @contextlib.contextmanager
     def discover_snapcraft_yaml(self):
@@ -80,24 +129,75 @@ class Processor:
             # Allowed hosts for this snap
             self.allowed_hosts = data.get('vendoring', self.allowed_hosts)
             data['vendoring'] = self.allowed_hosts
-            parts = data['parts']
-            with click.progressbar(data['parts'], label='Processing parts',
-                                   item_show_func=lambda x: x) as bar:
-                for part in bar:
-                    self.process_part(part, parts[part], data)
+            self.process_parts(data)
 
         self.logger.info('Preparing project')
         if self.dry_run:
             return
+        self.history.save()
         with open(os.path.join(self.vendored_source, path), 'w') as f:
             self.ordered_yaml_dump(data, f, default_flow_style=False)
             self.prepare_source(['master'], self.vendored_source,
                                 commit='Vendor {}'.format(data['name']))
-        for branch in self.branches:
-            self.logger.debug('Uploading {!r}'.format(branch))
-            if self.dry_run:
+        self.publish()
+        self.collect_garbage()
+
+    def publish(self):
+        if self.bundle:
+            self.export_bundle()
+            return
+        self.upload_branches()
+        if self.sync:
+            self.logger.info('Syncing to {!r} in the background'.format(
+                self.sync))
+            self.git.sync(vendorize.util.local_path(self.target), self.sync)
+
+    def collect_garbage(self):
+        if self.disk_budget is not None:
+            removed = self.workspace.collect(self.disk_budget)
+            for key in removed:
+                self.logger.debug('Removed {!r}'.format(key))
+            self.logger.info('Removed {} unused artifacts'.format(
+                len(removed)))
+        else:
+            self.workspace.save()
+
+    def upload_branches(self):
+        # Only push what the target doesn't have already
+        remote = self.git.list_remote(self.target)
+        counts = OrderedDict([('created', 0), ('updated', 0), ('skipped', 0)])
+        uploads = OrderedDict()  # type: Dict[str, List[str]]
+        # Gitlinks of parents refer to the exact commit of submodules
+        submodules = {branch for branch, _ in self.submodules.values()}
+        for branch, folder in self.branches.items():
+            commit = self.git.rev_parse(folder, branch)
+            if branch not in remote:
+                status = 'created'
+            elif commit == remote[branch] or (
+                    branch not in submodules and
+                    self.git.is_same_tree(folder, commit, remote[branch])):
+                status = 'skipped'
+            else:
+                status = 'updated'
+            counts[status] += 1
+            if status == 'skipped':
+                self.logger.debug('Up to date {!r}'.format(branch))
                 continue
-            self.git.upload_branch(self.branches[branch], branch, self.target)
+            uploads.setdefault(folder, []).append(branch)
+        for folder, branches in uploads.items():
+            self.logger.debug('Uploading {}'.format(', '.join(branches)))
+            self.git.upload_branches(folder, branches, self.target)
+        self.logger.info('Branches: {}'.format(', '.join(
+            '{} {}'.format(count, status)
+            for status, count in counts.items())))
+
+    def export_bundle(self):
+        repo = self.staging or os.path.join(
+            self.project_folder, 'parts', 'bundle.git')
+        self.git.init_bare(repo)
+        vendorize.bundle.export(self.git, self.branches, repo, self.bundle)
+        self.logger.info('Exported {} branches to {!r}'.format(
+            len(self.branches), self.bundle))
 
     def ordered_yaml_load(self, stream: IO[str]) -> Dict[str, Any]:
         class OrderedSafeLoader(yaml.SafeLoader):
@@ -123,8 +223,62 @@ class Processor:
         OrderedDumper.add_representer(OrderedDict, dict_representer)
         yaml.dump(data, stream, OrderedDumper, **kwargs)
 
+    def process_parts(self, data: dict):
+        # Parts are modified in place so the order in the YAML is preserved
+        parts = data['parts']
+        # Local parts are all committed in the one repository of the
+        # vendored source, so they're processed one at a time in YAML order
+        local = [part for part in parts if self.is_local_part(parts[part])]
+        order = self.history.order([part for part in parts
+                                    if part not in local])
+        self.progress = vendorize.progress.Progress(len(parts))
+        with self.progress:
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.jobs) as executor:
+                futures = [executor.submit(self.process_local_parts, local,
+                                           data)]
+                futures += [executor.submit(self.process_part, part,
+                                            parts[part], data)
+                            for part in order]
+                try:
+                    for future in concurrent.futures.as_completed(futures):
+                        future.result()
+                except Exception:
+                    for future in futures:
+                        future.cancel()
+                    raise
+
+    def is_local_part(self, part_data: dict) -> bool:
+        return vendorize.source.PartSource(
+            part_data, self.project_folder, self.allowed_hosts).type == 'local'
+
+    def process_local_parts(self, local: list, data: dict):
+        for part in local:
+            self.process_part(part, data['parts'][part], data)
+
     def process_part(self, part, part_data, data):
+        start = time.monotonic()
+        self.progress.report(part, 'fetching')
         source, source_copy = self.process_part_source(part, part_data)
+        fetched = time.monotonic()
+        # Filters only apply to vendoring and aren't known to snapcraft
+        for key in ['vendoring-include', 'vendoring-exclude']:
+            part_data.pop(key, None)
+        self.progress.report(part, 'processing')
+        self.process_part_plugin(part, part_data, data, source, source_copy)
+        if source.should_vendor:
+            self.progress.report(part, 'vendoring')
+            self.vendor_part(part, part_data, data, source, source_copy)
+        self.progress.finish(part)
+        if not self.dry_run and source.type != 'local':
+            # Sources are reused next time if they're left unchanged
+            size = self.workspace.record(source_copy, source.origin)
+            self.history.record(
+                part, fetch=fetched - start,
+                duration=time.monotonic() - start, size=size)
+
+    def process_part_plugin(self, part, part_data, data, source,
+                            source_copy):
         plugin = part_data.get('plugin')
         if plugin:
             part_processor = self.load_plugin(
@@ -138,18 +292,26 @@ class Processor:
                 self.die("No vendoring for {!r}".format(plugin))
         else:
             self.die("No vendoring for remote part {!r}".format(part))
-        if source.should_vendor:
-            repo, branch = self.prepare_source(
-                [data['name'], part], source_copy,
-                commit='Vendor {}'.format(part)).split('@')
-            part_data['source'] = repo
-            part_data['source-branch'] = branch
-            if 'source-tag' in part_data:
-                del part_data['source-tag']
+
+    def vendor_part(self, part, part_data, data, source, source_copy):
+        # Extracted archives and sparse clones have no repository, one may
+        # be left from vendoring them before
+        init = source.type != 'local' and (
+            source.type != 'git' or source.is_sparse())
+        repo, branch = self.prepare_source(
+            [data['name'], part], source_copy, init=init,
+            commit='Vendor {}'.format(part)).split('@')
+        part_data['source'] = repo
+        part_data['source-branch'] = branch
+        if 'source-tag' in part_data:
+            del part_data['source-tag']
 
     def process_part_source(self, part: str, part_data: dict) -> tuple:
         source = vendorize.source.PartSource(
-            part_data, self.project_folder, self.allowed_hosts)
+            part_data, self.project_folder, self.allowed_hosts,
+            reproducible=self.reproducible, cache_dir=self.cache_dir,
+            workspace=self.workspace, environ=self.environ,
+            progress=functools.partial(self.progress.report, part))
         self.logger.debug('Source: {!r}'.format(source.source))
         if source.type == 'local':
             source_copy = os.path.join(self.vendored_source, source.source)
@@ -157,9 +319,62 @@ class Processor:
             source_copy = os.path.join(self.project_folder,
                                        'parts', part, 'src')
             if not self.dry_run:
-                source.fetch(source_copy)
+                source.fetch(source_copy, jobs=self.jobs)
+                if source.type == 'git':
+                    # Submodules may be shared with other parts
+                    with self.submodules_lock:
+                        if self.process_submodules(source_copy,
+                                                   source.source):
+                            # The part has to point to the new .gitmodules
+                            source.should_vendor = True
         return source, source_copy
 
+    def process_submodules(self, copy: str, url: str) -> bool:
+        """Vendor the submodules of copy, a clone of url, to their own branch.
+
+        Submodules already vendored for another part are reused. Returns
+        True if .gitmodules was changed to point to the target.
+        """
+        changed = False
+        for name, path, submodule_url in self.git.list_submodules(copy):
+            submodule_url = vendorize.util.resolve_url(url, submodule_url)
+            submodule_copy = os.path.join(copy, path)
+            if not os.path.exists(os.path.join(submodule_copy, '.git')):
+                self.logger.debug('Skipping submodule {!r}'.format(path))
+                continue
+            key = (submodule_url, self.git.head(submodule_copy))
+            if key in self.submodules:
+                branch, commit = self.submodules[key]
+            else:
+                nested = self.process_submodules(submodule_copy,
+                                                 submodule_url)
+                if not (nested or vendorize.util.host_not_vendorized(
+                        submodule_url, self.allowed_hosts)):
+                    continue
+                branch = self.prepare_submodule(
+                    submodule_copy, submodule_url, key[1], nested)
+                commit = self.git.rev_parse(self.branches[branch], branch)
+                self.submodules[key] = (branch, commit)
+            # The parent needs to refer to the vendored commit
+            if key[1] != commit:
+                self.git.checkout_branch(
+                    submodule_copy, self.branches[branch], branch)
+            self.git.set_submodule(copy, name, self.clone_url, branch)
+            changed = True
+        return changed
+
+    def prepare_submodule(self, copy: str, url: str, commit: str,
+                          nested: bool) -> str:
+        name = os.path.basename(url.rstrip('/'))
+        if name.endswith('.git'):
+            name = name[:-len('.git')]
+        self.logger.debug('Vendoring submodule {!r}'.format(url))
+        # Only commit if nested submodules were rewritten
+        return self.prepare_source(
+            ['submodules', name, commit[:12]], copy,
+            commit='Vendor {}'.format(name) if nested else None).rsplit(
+                '@', 1)[1]
+
     def load_plugin(self, plugin: str, data: dict, part: str,
                     source: str, copy: str):
         with contextlib.suppress(ImportError):
@@ -175,7 +390,7 @@ class Processor:
         self.logger.debug('Copying {!r} to {!r}'.format(source, destination))
         # If this is a git repository we can clone it efficiently
         if os.path.exists(os.path.join(source, '.git')):
-            self.git.clone(source, destination)
+            self.git.clone(source, destination, jobs=self.jobs)
         else:
             self.die('Cannot copy {!r}'.format(source))
 
@@ -184,6 +399,36 @@ class Processor:
         branch = '_'.join(path)
         self.logger.debug('Preparing {!r}'.format(copy))
         if not self.dry_run:
-            self.git.prepare_branch(copy, branch, init=init, commit=commit)
-        self.branches[branch] = copy
+            date = None
+            if self.reproducible and commit:
+                date = self.commit_date(copy, init)
+            with self.repository_lock(copy, init):
+                if self.staging:
+                    self.git.stage_branch(
+                        self.staging, copy, branch, init=init,
+                        commit=commit, date=date, previous=self.previous)
+                else:
+                    self.git.prepare_branch(
+                        copy, branch, init=init,
+                        commit=commit, date=date, previous=self.previous)
+        self.branches[branch] = self.staging or copy
         return '{}@{}'.format(self.clone_url, branch)
+
+    def repository_lock(self, copy: str, init: bool) -> threading.Lock:
+        # Parts processed concurrently may share a repository
+        repository = self.staging
+        if not repository:
+            repository = copy if init else self.git.toplevel(copy)
+        with self.lock:
+            return self.locks.setdefault(repository, threading.Lock())
+
+    def commit_date(self, copy: str, init: bool) -> str:
+        epoch = vendorize.util.source_date_epoch(self.environ)
+        if epoch is not None:
+            return str(epoch)
+        # New repositories use the date recorded when the source was
+        # fetched or the files, otherwise the upstream commit
+        if init:
+            return vendorize.source.upstream_date(copy) or str(
+                vendorize.util.newest_mtime(copy))
+        return self.git.commit_date(copy)
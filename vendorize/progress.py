@@ -0,0 +1,117 @@
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+import vendorize.log
+
+
+def format_size(size: float) -> str:
+    if size < 1024:
+        return '{} B'.format(int(size))
+    for unit in ['KiB', 'MiB', 'GiB']:
+        size /= 1024
+        if size < 1024:
+            break
+    return '{:.1f} {}'.format(size, unit)
+
+
+class Task:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.state = 'waiting'
+        self.done = 0
+        self.total = None  # type: Optional[int]
+        self.started = self.created = time.monotonic()
+
+    def throughput(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.done / elapsed if elapsed > 0 else 0
+
+    def eta(self) -> Optional[float]:
+        rate = self.throughput()
+        if not self.total or not rate:
+            return None
+        return max(0, self.total - self.done) / rate
+
+    def describe(self) -> str:
+        description = '{} {}'.format(self.name, self.state)
+        if not self.done:
+            return description
+        description += ' {}'.format(format_size(self.done))
+        if self.total:
+            description += '/{}'.format(format_size(self.total))
+        description += ' {}/s'.format(format_size(self.throughput()))
+        eta = self.eta()
+        if eta is not None:
+            description += ' ETA {}s'.format(int(eta))
+        return description
+
+
+class Progress:
+    """Progress of parts processed concurrently.
+
+    Workers report what each part is doing and how many bytes it has
+    downloaded or extracted. On a terminal a status line with the running
+    parts is redrawn at most every interval seconds, otherwise a line is
+    written as each part finishes so that log collectors aren't flooded.
+    """
+    def __init__(self, total: int, *, interval: float=0.2) -> None:
+        self.total = total
+        self.interval = interval
+        self.finished = 0
+        self.tasks = OrderedDict()  # type: OrderedDict
+        self.lock = threading.Lock()
+        self.drawn = 0.0
+
+    def report(self, name: str, state: str, done: int=0, total: int=None):
+        """Reports that name is in state, having processed done out of
+        total bytes, if known."""
+        with self.lock:
+            task = self.tasks.get(name)
+            if not task:
+                task = self.tasks[name] = Task(name)
+            changed = task.state != state
+            if changed:
+                # Throughput is measured per state
+                task.state = state
+                task.started = time.monotonic()
+            task.done = done
+            task.total = total
+        self.draw(force=changed)
+
+    def finish(self, name: str):
+        with self.lock:
+            task = self.tasks.pop(name, None)
+            self.finished += 1
+        if task and not vendorize.log.is_interactive():
+            vendorize.log.echo(__name__, '[{}/{}] {} done in {:.1f}s'.format(
+                self.finished, self.total, name,
+                time.monotonic() - task.created))
+        self.draw(force=True)
+
+    def status(self) -> str:
+        with self.lock:
+            return ' | '.join(['[{}/{}]'.format(self.finished, self.total)] +
+                              [t.describe() for t in self.tasks.values()])
+
+    def draw(self, force=False):
+        now = time.monotonic()
+        with self.lock:
+            if not force and now - self.drawn < self.interval:
+                return
+            self.drawn = now
+        # Wrapped lines can't be redrawn
+        width = shutil.get_terminal_size().columns - 1
+        vendorize.log.set_status(self.status()[:width])
+
+    def close(self):
+        vendorize.log.set_status('')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,64 @@
+import json
+import os
+import threading
+from typing import List
+
+
+class History:
+    """Costs of processing each part in previous runs.
+
+    For every part the time it took to fetch its sources, the time it took
+    to process it in total and the size of its sources are recorded.
+    """
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self.parts = {}  # type: dict
+        self.lock = threading.Lock()
+        try:
+            with open(self.filename) as f:
+                self.parts = json.load(f)
+        except (OSError, ValueError):
+            # No history yet, or one that can't be used
+            pass
+
+    def record(self, part: str, *, fetch: float, duration: float,
+               size: int):
+        with self.lock:
+            self.parts[part] = {
+                'fetch': round(fetch, 3),
+                'duration': round(duration, 3),
+                'size': size,
+            }
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        with self.lock:
+            with open(self.filename, 'w') as f:
+                json.dump(self.parts, f, indent=2, sort_keys=True)
+
+    def cost(self, part: str) -> float:
+        return self.parts.get(part, {}).get('duration', 0)
+
+    def is_network_bound(self, part: str) -> bool:
+        costs = self.parts[part]
+        return costs.get('fetch', 0) >= costs.get('duration', 0) / 2
+
+    def order(self, parts: List[str]) -> List[str]:
+        """Returns parts in the order they should be processed in.
+
+        Parts never seen before come first since their cost is unknown,
+        followed by the most expensive ones, alternating between those
+        mostly waiting for the network and those mostly using the CPU.
+        """
+        ordered = [p for p in parts if p not in self.parts]
+        known = sorted([p for p in parts if p in self.parts],
+                       key=self.cost, reverse=True)
+        network = [p for p in known if self.is_network_bound(p)]
+        cpu = [p for p in known if not self.is_network_bound(p)]
+        if network and cpu and self.cost(cpu[0]) > self.cost(network[0]):
+            network, cpu = cpu, network
+        while network or cpu:
+            for queue in [network, cpu]:
+                if queue:
+                    ordered.append(queue.pop(0))
+        return ordered
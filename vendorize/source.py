@@ -1,19 +1,49 @@
 import click
+import fnmatch
+import functools
+import hashlib
+import json
 import os
 import re
-import urllib.request
+import shutil
+import urllib.parse
 import tarfile
-from typing import List
+from typing import Callable, List, Optional
 
 
+import vendorize.decompress
+import vendorize.download
 import vendorize.git
 import vendorize.util
+import vendorize.workspace
+
+
+def upstream_date(folder: str) -> Optional[str]:
+    """Returns the date of the upstream of folder, if it was recorded when
+    it was fetched without a repository."""
+    try:
+        with open(folder + '.date') as f:
+            return f.read().strip()
+    except OSError:
+        return None
 
 
 class PartSource:
     def __init__(self, part_data: dict, project_folder: str,
-                 allowed_hosts: list) -> None:
+                 allowed_hosts: list, *, reproducible: bool=False,
+                 cache_dir: str=None,
+                 workspace: vendorize.workspace.Workspace=None,
+                 progress: Callable=None, environ: dict=None) -> None:
         self.project_folder = project_folder
+        # Identity and SOURCE_DATE_EPOCH of the run, if not this process
+        self.environ = environ
+        self.reproducible = reproducible
+        self.cache_dir = cache_dir
+        self.workspace = workspace
+        # Called with a state, the bytes processed and the total, if known
+        self.progress = progress
+        self.downloader = vendorize.download.Downloader(
+            progress=functools.partial(self.report, 'downloading'))
         self.source = part_data.get('source', '.')
         self.should_vendor = vendorize.util.host_not_vendorized(
             self.source, allowed_hosts)
@@ -23,6 +53,15 @@ class PartSource:
         elif self.type == 'git':
             self.branch = part_data.get('source-branch',
                                         part_data.get('source-tag'))
+        # Only the parts of the source that are actually built are vendored
+        self.subdir = part_data.get('source-subdir')
+        self.include = part_data.get('vendoring-include', [])
+        self.exclude = part_data.get('vendoring-exclude', [])
+        # Everything that determines the contents of a fetched copy
+        self.origin = json.dumps([
+            self.source, self.type, part_data.get('source-branch'),
+            part_data.get('source-tag'), self.subdir, self.include,
+            self.exclude, self.reproducible])
 
     def guess_type(self, source_type: str=None) -> str:
         if source_type:
@@ -33,35 +72,76 @@ class PartSource:
               self.source.startswith('git@') or
                 self.source.endswith('.git')):
             return 'git'
-        elif re.match(r'.*\.((tar(\.(xz|gz|bz2))?)|tgz)$', self.source):
+        elif re.match(r'.*\.((tar(\.(xz|gz|bz2|zst))?)|tgz|tzst)$',
+                      self.source):
             return 'tar'
         raise click.ClickException('Unknown source: {!r}'.format(self.source))
 
-    def fetch(self, destination):
+    def fetch(self, destination: str, *, jobs: int=None):
         if os.path.isdir(os.path.join(self.project_folder, self.source)):
             self.source = os.path.join(self.project_folder, self.source)
         if os.path.exists(destination):
-            return
+            if self.is_reusable(destination):
+                return
+            shutil.rmtree(destination)
+        if os.path.exists(destination + '.date'):
+            os.remove(destination + '.date')
         if self.type == 'git':
-            git = vendorize.git.Git()
-            git.clone(self.source, destination, self.branch)
+            self.report('cloning')
+            git = vendorize.git.Git(self.environ)
+            git.clone(self.source, destination, self.branch, jobs=jobs,
+                      sparse=self.sparse_patterns())
+            if self.is_sparse():
+                self.record_date(destination, git.commit_date(destination))
+                # History and other paths are left behind, submodules are
+                # vendored as part of the source
+                self.remove_repositories(destination)
         elif self.type in ['deb', 'tar', 'zip']:
             if not self.should_vendor:
                 return
             self.extract(self.download(), destination)
+            # Members keep their times, files written later won't
+            self.record_date(destination, str(
+                vendorize.util.newest_mtime(destination)))
         else:
             raise click.ClickException('Unknown type: {!r}'.format(self.type))
         self.source = os.path.join(self.project_folder, destination)
 
+    def record_date(self, destination: str, date: str):
+        # Commits of copies without a repository use the upstream's date
+        if self.reproducible:
+            with open(destination + '.date', 'w') as f:
+                f.write(date)
+
+    def remove_repositories(self, folder: str):
+        for root, dirs, files in os.walk(folder):
+            if '.git' in dirs:
+                dirs.remove('.git')
+                shutil.rmtree(os.path.join(root, '.git'))
+            elif '.git' in files:
+                # Submodules only refer to the repository of their parent
+                os.remove(os.path.join(root, '.git'))
+
+    def is_reusable(self, destination: str) -> bool:
+        # Copies may be incomplete, modified or from another source
+        if not self.workspace:
+            return True
+        return self.workspace.verify(destination, self.origin)
+
     def download(self) -> str:
         if self.is_url():
-            cache = os.path.join(self.project_folder, 'parts')
+            if self.cache_dir:
+                # Different URLs may use the same file name
+                cache = os.path.join(self.cache_dir, 'downloads',
+                                     hashlib.sha1(
+                                         self.source.encode()).hexdigest())
+            else:
+                cache = os.path.join(self.project_folder, 'parts')
             os.makedirs(cache, exist_ok=True)
             filename = os.path.join(cache, os.path.basename(self.source))
-            if not os.path.exists(filename):
-                data = urllib.request.urlopen(self.source).read()
-                with open(filename, 'wb') as f:
-                    f.write(data)
+            self.downloader.fetch(self.source, filename)
+            if self.workspace and not self.cache_dir:
+                self.workspace.record(filename, self.source)
             return filename
         return self.source
 
@@ -70,31 +150,87 @@ class PartSource:
 
     def extract(self, archive: str, destination: str):
         try:
-            with tarfile.open(archive) as tar:
-                def is_within_directory(directory, target):
-                    
-                    abs_directory = os.path.abspath(directory)
-                    abs_target = os.path.abspath(target)
-                
-                    prefix = os.path.commonprefix([abs_directory, abs_target])
-                    
-                    return prefix == abs_directory
-                
-                def safe_extract(tar, path=".", members=None, *, numeric_owner=False):
-                
-                    for member in tar.getmembers():
-                        member_path = os.path.join(path, member.name)
-                        if not is_within_directory(path, member_path):
-                            raise Exception("Attempted Path Traversal in Tar File")
-                
-                    tar.extractall(path, members, numeric_owner=numeric_owner) 
-                    
-                
-                safe_extract(tar, members=self.filter_members(tar.getmembers()), path=destination)
-                               path=destination)
+            with vendorize.decompress.open_stream(archive) as stream:
+                if stream and self.extract_stream(stream, archive,
+                                                  destination):
+                    stream.finish()
+                    return
+            # Fall back to reading the whole archive to find its prefix
+            if os.path.exists(destination):
+                shutil.rmtree(destination)
+            with vendorize.decompress.open_tar(archive) as tar:
+                members = list(self.filter_members(tar.getmembers()))
+                for m in members:
+                    self.check_safe(archive, destination, m)
+                tar.extractall(members=members, path=destination)
+                self.report('extracting', sum(m.size for m in members))
         except tarfile.TarError:
             raise click.ClickException('Cannot extract {!r}'.format(archive))
 
+    def extract_stream(self, stream, archive: str, destination: str) -> bool:
+        """Extracts members while they are being decompressed.
+
+        This only works if the first member is the only top-level folder,
+        False is returned as soon as a member outside of it is found.
+        """
+        epoch = vendorize.util.source_date_epoch(self.environ)
+        prefix = None
+        extracted = 0
+        with vendorize.decompress.pipe(stream) as tar:
+            for m in tar:
+                extracted += m.size
+                self.report('extracting', extracted)
+                if prefix is None:
+                    prefix = m.name.rstrip('/')
+                    if (not m.isdir() or '/' in prefix or
+                            prefix in ['', '.', '..']):
+                        return False
+                    continue
+                if not m.name.startswith(prefix + '/'):
+                    return False
+                if not self.filter_member(prefix, m, epoch):
+                    continue
+                self.check_safe(archive, destination, m)
+                tar.extract(m, path=destination)
+        return prefix is not None
+
+    def check_safe(self, archive: str, destination: str,
+                   member: tarfile.TarInfo):
+        if not self.is_within(destination, member.name):
+            raise click.ClickException(
+                'Unsafe path {!r} in {!r}'.format(member.name, archive))
+
+    def report(self, state: str, done: int=0, total: int=None):
+        if self.progress:
+            self.progress(state, done, total)
+
+    def is_within(self, directory: str, name: str) -> bool:
+        directory = os.path.abspath(directory)
+        path = os.path.abspath(os.path.join(directory, name))
+        return os.path.commonpath([directory, path]) == directory
+
+    def is_sparse(self) -> bool:
+        return bool(self.subdir or self.include or self.exclude)
+
+    def sparse_patterns(self) -> List[str]:
+        if not self.is_sparse():
+            return []
+        # Patterns use gitignore syntax, anchored to the root of the source
+        paths = ([self.subdir] if self.subdir else []) + self.include
+        patterns = ['/' + p.strip('/') for p in paths] or ['/**']
+        return patterns + ['!/' + p.strip('/') for p in self.exclude]
+
+    def is_wanted(self, name: str) -> bool:
+        paths = ([self.subdir] if self.subdir else []) + self.include
+        if paths and not any(self.matches(name, p) for p in paths):
+            return False
+        return not any(self.matches(name, p) for p in self.exclude)
+
+    def matches(self, name: str, pattern: str) -> bool:
+        pattern = pattern.strip('/')
+        return (fnmatch.fnmatch(name, pattern) or
+                fnmatch.fnmatch(name, pattern + '/*'))
+
     def filter_members(self, members: List[tarfile.TarInfo]):
         prefix = os.path.commonprefix([m.name for m in members])
         for m in members:
@@ -102,15 +238,33 @@ class PartSource:
                     m.isdir() and m.name == prefix):
                 prefix = os.path.dirname(prefix)
                 break
+        epoch = vendorize.util.source_date_epoch(self.environ)
         for m in members:
             if m.name == prefix:
                 continue
-            self.strip_prefix(prefix + '/', m)
-            # Ensure files are writable
-            m.mode = m.mode | 0o200
-            yield m
+            if self.filter_member(prefix, m, epoch):
+                yield m
         return members
 
+    def filter_member(self, prefix: str, member: tarfile.TarInfo,
+                      epoch: int=None) -> bool:
+        self.strip_prefix(prefix + '/', member)
+        if not self.is_wanted(member.name):
+            return False
+        # Ensure files are writable
+        member.mode = member.mode | 0o200
+        if self.reproducible:
+            self.normalize(member, epoch)
+        return True
+
+    def normalize(self, member: tarfile.TarInfo, epoch: int=None):
+        # Only the executable bit is meaningful for git
+        member.mode = 0o755 if member.isdir() or member.mode & 0o111 else 0o644
+        if epoch is not None:
+            member.mtime = epoch
+        member.uid = member.gid = 0
+        member.uname = member.gname = ''
+
     def strip_prefix(self, prefix: str, member: tarfile.TarInfo):
         member.name = self.strip_slash(prefix, member.name)
         # Strip hardlinks
@@ -1,19 +1,105 @@
 import contextlib
 import os
-from urllib.parse import urlparse
+import posixpath
+import socket
+import threading
+from typing import Optional
+from urllib.parse import urljoin, urlparse
+
+
+# The working directory is shared by all threads
+_chdir_lock = threading.RLock()
 
 
 @contextlib.contextmanager
 def chdir(path: str):
-    cwd = os.getcwd()
-    os.chdir(path)
-    try:
-        yield path
-    finally:
-        os.chdir(cwd)
+    with _chdir_lock:
+        cwd = os.getcwd()
+        os.chdir(path)
+        try:
+            yield path
+        finally:
+            os.chdir(cwd)
 
 
 def host_not_vendorized(location: str, allowed_hosts: list) -> bool:
     url = urlparse(location)
     host = url.netloc
     return bool(host and host not in allowed_hosts)
+
+
+# Hosts that could be resolved before
+_resolved = set()  # type: set
+_resolved_lock = threading.Lock()
+
+
+def is_resolvable(host: str) -> bool:
+    # Failures may be transient so only successful lookups are remembered
+    with _resolved_lock:
+        if host in _resolved:
+            return True
+    try:
+        socket.gethostbyname(host)
+    except socket.gaierror:
+        return False
+    with _resolved_lock:
+        _resolved.add(host)
+    return True
+
+
+def is_local(url: str) -> bool:
+    return url.startswith('file://') or not urlparse(url).scheme
+
+
+def local_path(url: str) -> str:
+    return urlparse(url).path if url.startswith('file://') else url
+
+
+def is_bare_repository(path: str) -> bool:
+    return (os.path.isfile(os.path.join(path, 'HEAD')) and
+            os.path.isdir(os.path.join(path, 'objects')) and
+            not os.path.exists(os.path.join(path, '.git')))
+
+
+def clone_url(target: str) -> str:
+    if not urlparse(target).scheme:
+        # Tools like pip only accept URLs, also for local repositories
+        return 'file://' + os.path.abspath(target)
+    # Pushing requires SSH but anyone can clone via HTTPS
+    return target.replace('git+ssh://', 'https://')
+
+
+def resolve_url(base: str, url: str) -> str:
+    # Relative URLs like those in .gitmodules are relative to the base
+    if not (url.startswith('./') or url.startswith('../')):
+        return url
+    if urlparse(base).scheme:
+        return urljoin(base.rstrip('/') + '/', url)
+    return posixpath.normpath(posixpath.join(base, url))
+
+
+def source_date_epoch(environ: dict=None) -> Optional[int]:
+    # https://reproducible-builds.org/specs/source-date-epoch/
+    epoch = (os.environ if environ is None else environ).get(
+        'SOURCE_DATE_EPOCH')
+    return int(epoch) if epoch and epoch.isdigit() else None
+
+
+def newest_mtime(folder: str) -> int:
+    newest = 0
+    for root, dirs, files in os.walk(folder):
+        if '.git' in dirs:
+            dirs.remove('.git')
+        for name in files:
+            path = os.path.join(root, name)
+            if not os.path.islink(path):
+                newest = max(newest, int(os.path.getmtime(path)))
+    return newest
+
+
+def disk_usage(folder: str) -> int:
+    size = 0
+    for root, dirs, files in os.walk(folder):
+        for name in files:
+            size += os.lstat(os.path.join(root, name)).st_size
+    return size
@@ -0,0 +1,188 @@
+import click
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from typing import List, Tuple
+
+
+import vendorize.util
+
+
+# Files kept next to downloads, see vendorize.download.Downloader, and
+# next to fetched sources, see vendorize.source.PartSource.record_date
+_SIDECARS = ['.json', '.part', '.part.json', '.date']
+
+_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+
+def parse_size(value: str) -> int:
+    match = re.match(r'^\s*(\d+)\s*([KMGT]?)i?B?\s*$', value, re.IGNORECASE)
+    if not match:
+        raise ValueError('Invalid size: {!r}'.format(value))
+    return int(match.group(1)) * _UNITS[match.group(2).upper()]
+
+
+class Workspace:
+    """Artifacts kept in the parts folder of a project between runs.
+
+    For every clone, extracted archive, download and package folder the
+    manifest records its size, when it was last used, where it came from
+    and a fingerprint of its contents. Artifacts can thus be verified
+    before they're reused, and the least recently used ones removed to
+    stay within a disk budget.
+    """
+    def __init__(self, folder: str) -> None:
+        self.folder = folder
+        self.filename = os.path.join(folder, 'manifest.json')
+        self.artifacts = {}  # type: dict
+        self.lock = threading.Lock()
+        # Anything used since is needed by the current run
+        self.started = time.time()
+        try:
+            with open(self.filename) as f:
+                self.artifacts = json.load(f)
+        except (OSError, ValueError):
+            # No manifest yet, or one that can't be used
+            pass
+
+    def key(self, path: str) -> str:
+        return os.path.relpath(os.path.abspath(path), self.folder)
+
+    def record(self, path: str, origin: str=None) -> int:
+        """Records that path, fetched from origin, was used and returns its
+        size in bytes."""
+        size, digest = self.fingerprint(path)
+        with self.lock:
+            self.artifacts[self.key(path)] = {
+                'origin': origin,
+                'size': size,
+                'digest': digest,
+                'used': time.time(),
+            }
+        return size
+
+    def verify(self, path: str, origin: str=None) -> bool:
+        """Returns True if path is exactly as it was last recorded."""
+        with self.lock:
+            entry = self.artifacts.get(self.key(path))
+        if not entry or entry.get('origin') != origin:
+            return False
+        if self.fingerprint(path)[1] != entry.get('digest'):
+            return False
+        with self.lock:
+            entry['used'] = time.time()
+        return True
+
+    def fingerprint(self, path: str) -> Tuple[int, str]:
+        # Metadata of every file changes if it's modified or incomplete
+        digest = hashlib.sha1()
+        size = 0
+        for name in self.files(path):
+            stat = os.lstat(os.path.join(path, name) if name else path)
+            size += stat.st_size
+            digest.update('{}\0{}\0{}\0'.format(
+                name, stat.st_size, stat.st_mtime_ns).encode())
+        return size, digest.hexdigest()
+
+    def files(self, path: str) -> List[str]:
+        if not os.path.isdir(path) or os.path.islink(path):
+            return [''] if os.path.lexists(path) else []
+        files = []
+        for root, dirs, names in os.walk(path):
+            # The repositories of vendored branches don't affect sources
+            if '.git' in dirs:
+                dirs.remove('.git')
+            dirs.sort()
+            for name in sorted(names):
+                files.append(os.path.relpath(os.path.join(root, name), path))
+        return files
+
+    def save(self):
+        with self.lock:
+            self.artifacts = {key: entry
+                              for key, entry in self.artifacts.items()
+                              if os.path.lexists(
+                                  os.path.join(self.folder, key))}
+            os.makedirs(self.folder, exist_ok=True)
+            with open(self.filename, 'w') as f:
+                json.dump(self.artifacts, f, indent=2, sort_keys=True)
+
+    def discover(self) -> dict:
+        """Returns the time of last use and size of every artifact.
+
+        Downloads and other files are artifacts, and so is every folder of
+        a part. Artifacts that aren't in the manifest, like those left by
+        older versions, were last used when they were last modified.
+        """
+        found = {}  # type: dict
+        if not os.path.isdir(self.folder):
+            return found
+        paths = []
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            if path == self.filename:
+                continue
+            if os.path.isdir(path) and not name.endswith('.git'):
+                paths += [os.path.join(path, child)
+                          for child in os.listdir(path)]
+            else:
+                paths.append(self.strip_sidecar(path))
+        for path in set(paths):
+            entry = self.artifacts.get(self.key(path))
+            if entry:
+                found[self.key(path)] = (entry['used'], entry['size'])
+                continue
+            size = sum(os.lstat(p).st_size for p in self.companions(path)
+                       if os.path.isfile(p))
+            if os.path.isdir(path):
+                size += vendorize.util.disk_usage(path)
+            found[self.key(path)] = (self.mtime(path), size)
+        return found
+
+    def strip_sidecar(self, path: str) -> str:
+        for suffix in sorted(_SIDECARS, key=len, reverse=True):
+            if path.endswith(suffix):
+                return path[:-len(suffix)]
+        return path
+
+    def companions(self, path: str) -> List[str]:
+        return [path] + [path + suffix for suffix in _SIDECARS]
+
+    def mtime(self, path: str) -> float:
+        return max(os.lstat(p).st_mtime for p in self.companions(path)
+                   if os.path.lexists(p))
+
+    def collect(self, budget: int) -> List[str]:
+        """Removes the least recently used artifacts until all of them use
+        at most budget bytes. Artifacts used by this run are kept."""
+        found = self.discover()
+        total = sum(size for used, size in found.values())
+        removed = []
+        for key in sorted(found, key=lambda k: found[k][0]):
+            used, size = found[key]
+            if total <= budget:
+                break
+            if used >= self.started:
+                continue
+            self.remove(os.path.join(self.folder, key))
+            total -= size
+            removed.append(key)
+        self.save()
+        return removed
+
+    def remove(self, path: str):
+        try:
+            for p in self.companions(path):
+                if os.path.isdir(p) and not os.path.islink(p):
+                    shutil.rmtree(p)
+                elif os.path.lexists(p):
+                    os.remove(p)
+        except OSError as e:
+            raise click.ClickException(
+                'Cannot remove {!r}: {}'.format(path, e.strerror))
+        with self.lock:
+            self.artifacts.pop(self.key(path), None)